@@ -3,6 +3,10 @@ ASGI config for Personal_Manager project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve the project with an ASGI server (e.g. ``uvicorn Personal_Manager.asgi:application``)
+so the streaming views (the AI chat stream, attachment downloads) are sent
+piece by piece without holding a worker thread per open response.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
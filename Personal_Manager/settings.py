@@ -26,6 +26,25 @@ load_dotenv(os.path.join(BASE_DIR, '.env'))
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('DJANGO_KEY')
 FERNET_KEY = b'8FwtQCZ1Qd6ozeREDK3Co_sUhr7J2PDbzrgFUvWFvdA='
+# Encryption keyring, newest first. To rotate, put a new key first, deploy,
+# then run `manage.py rotate_keys`; once it reports success the old keys can
+# be removed. FERNET_KEY itself stays: the search index is derived from it.
+FERNET_KEYS = [
+    FERNET_KEY,
+]
+# Per-process cache of unwrapped per-user data keys. 'ttl' (seconds) bounds
+# how long a deleted key stays usable in other worker processes.
+DATA_KEY_CACHE = {
+    'max_entries': 1024,
+    'ttl': 300,
+}
+# Where new attachment blobs are stored (see notes/blobstore.py): 'db' keeps
+# the encrypted chunks in the database, 'fs' in files under ROOT. Existing
+# blobs stay readable when this changes.
+ATTACHMENT_STORAGE = {
+    'BACKEND': os.environ.get('ATTACHMENT_BACKEND', 'db'),
+    'ROOT': os.environ.get('ATTACHMENT_ROOT', BASE_DIR / 'blobs'),
+}
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -86,6 +105,35 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'default' and 'template_fragments' live in each process's memory (least
+# recently used entries are evicted first); cached pages hold decrypted notes,
+# so they are never written to disk. 'shared' is on disk, seen by every process
+# on the host, and only holds small values that are not note data: the
+# per-user cache versions (see notes/caching.py).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_ROOT', BASE_DIR / 'cache'),
+        'TIMEOUT': 24 * 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -136,4 +184,65 @@ LOGOUT_REDIRECT_URL = 'notes:login'       # where to go after logout
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
-GOOGLE_API_KEY = os.environ.get('AI_API_KEY')
\ No newline at end of file
+GOOGLE_API_KEY = os.environ.get('AI_API_KEY')
+
+# AI chat backend (see notes/llm.py). Set AI_BACKEND=notes.llm.LocalBackend to
+# use the deterministic local stand-in (no network, no API key), e.g. for tests
+# and load tests; AI_LOCAL_DELAY makes it sleep per streamed piece.
+AI_BACKEND = os.environ.get('AI_BACKEND', 'notes.llm.GeminiBackend')
+AI_BACKEND_OPTIONS = {}
+if AI_BACKEND == 'notes.llm.LocalBackend':
+    AI_BACKEND_OPTIONS = {'delay': float(os.environ.get('AI_LOCAL_DELAY', '0'))}
+AI_MODEL_NAME = 'gemini-2.5-pro'
+
+# In-process cache of model replies, keyed by model, prompt and note content.
+AI_RESPONSE_CACHE = {
+    'max_entries': 256,
+    'ttl': 60 * 60,  # seconds
+}
+
+# Note context per chat prompt, in (estimated) tokens. A longer note is split
+# into pieces of 'chunk_tokens', which are summarized by at most 'workers'
+# concurrent model calls per process, and the summaries are used instead.
+# Chat history beyond 'history_tokens' is folded into a rolling summary.
+AI_CONTEXT_BUDGET = {
+    'context_tokens': 8000,
+    'chunk_tokens': 2000,
+    'workers': 4,
+    'history_tokens': 3000,
+}
+# In-process cache of those piece summaries, keyed by a hash of the piece, so
+# follow-up questions about the same note skip the summarizing.
+AI_SUMMARY_CACHE = {
+    'max_entries': 1024,
+    'ttl': 24 * 60 * 60,  # seconds
+}
+
+# Note summaries made by `manage.py summarize_notes` (run nightly): at most
+# 'concurrency' notes at a time and 'requests_per_minute' model calls. Notes
+# shorter than 'min_words' are not summarized; their preview says it all.
+AI_NOTE_SUMMARIES = {
+    'concurrency': 4,
+    'requests_per_minute': 60,
+    'min_words': 40,
+}
+
+# Background jobs (see notes/jobs.py), run by `manage.py run_jobs`. A failed
+# job is retried up to 'max_attempts' times in all, first after
+# 'retry_backoff' seconds, doubling per attempt up to 'max_backoff'. A job
+# still running after 'stale_after' seconds is taken to have lost its worker
+# and is queued again.
+# Queued jobs (e.g. replies to POST /chat/) only run while at least one
+# `manage.py run_jobs` process is up next to the web server, so start one
+# with it. For a setup without workers (local development), JOB_QUEUE_EAGER=1
+# turns on 'eager': jobs then run inline in the request that queues them,
+# which makes that request as slow as the job.
+JOB_QUEUE = {
+    'eager': os.environ.get('JOB_QUEUE_EAGER') == '1',
+    'concurrency': 2,
+    'poll_interval': 1.0,  # seconds
+    'max_attempts': 3,
+    'retry_backoff': 10,  # seconds
+    'max_backoff': 10 * 60,
+    'stale_after': 15 * 60,
+}
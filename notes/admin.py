@@ -1,12 +1,13 @@
 from django.contrib import admin
-from .models import Note, Task
+from django.utils import timezone
+from .models import Attachment, Blob, Job, Note, Task
 
 class NoteAdmin(admin.ModelAdmin):
     # Show these fields in the list view
     list_display = ('title', 'user', 'created_at', 'attachment_name')
     
     # Do not show the encrypted fields in the admin edit form
-    exclude = ('encrypted_content', 'encrypted_attachment')
+    exclude = ('encrypted_content',)
     
     # Make 'content' property read-only in the admin
     readonly_fields = ('content_display',)
@@ -28,5 +29,43 @@ class NoteAdmin(admin.ModelAdmin):
     def get_readonly_fields(self, request, obj=None):
         return self.readonly_fields + ('attachment_name',)
 
+    def get_queryset(self, request):
+        # Load attachment metadata for the list, never the encrypted bytes
+        return super().get_queryset(request).select_related('attachment')
+
+class AttachmentAdmin(admin.ModelAdmin):
+    list_display = ('name', 'note', 'content_type', 'size', 'created_at')
+    readonly_fields = ('note', 'blob', 'name', 'content_type', 'size', 'digest')
+    list_select_related = ('note', 'blob')
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('digest', 'user', 'size', 'refcount', 'backend', 'created_at')
+    # The encrypted chunks are never shown in the admin
+    exclude = ('nonce',)
+    readonly_fields = (
+        'user', 'digest', 'size', 'chunk_count', 'key_id', 'storage_version', 'backend', 'location', 'refcount'
+    )
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'user', 'status', 'attempts', 'run_after', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    # Payload and result are encrypted and never shown in the admin
+    exclude = ('encrypted_payload', 'encrypted_result')
+    readonly_fields = (
+        'user', 'kind', 'status', 'error', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'locked_at',
+        'finished_at',
+    )
+    actions = ['retry']
+
+    @admin.action(description="Queue selected failed jobs again")
+    def retry(self, request, queryset):
+        queued = queryset.filter(status=Job.FAILED).update(
+            status=Job.QUEUED, attempts=0, error='', run_after=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f"Queued {queued} job(s) again.")
+
 admin.site.register(Note, NoteAdmin) # Register with our custom admin
+admin.site.register(Attachment, AttachmentAdmin)
+admin.site.register(Blob, BlobAdmin)
+admin.site.register(Job, JobAdmin)
 admin.site.register(Task)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""
+Storage backends for attachment blobs (see models.Blob).
+
+A blob is a sequence of encrypted chunks. Every Blob row records the backend
+its chunks were written to, so blobs stay readable when
+settings.ATTACHMENT_STORAGE['BACKEND'] (the backend for new blobs) changes:
+
+- 'db' keeps each chunk in an AttachmentChunk row.
+- 'fs' keeps each blob in one file under ATTACHMENT_STORAGE['ROOT'], in
+  directories sharded by the first characters of its digest, so large files
+  stay out of the database entirely.
+
+Backends only move ciphertext around; encryption happens in models.Blob.
+"""
+import functools
+import os
+import secrets
+import struct
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+# How many chunks to buffer before writing them out (~1 MB).
+WRITE_BATCH_SIZE = 16
+
+
+class BlobNotFound(Exception):
+    """
+    Raised when reading a blob whose stored chunks are gone.
+    """
+
+
+class BlobBackend:
+    """
+    Interface of a blob backend. Chunks are (index, data) pairs in index order.
+    """
+    name = ''
+
+    def write(self, blob, chunks):
+        """
+        Stores the chunks of a new blob and returns its location.
+        """
+        raise NotImplementedError
+
+    def read(self, blob, first_index, last_index):
+        """
+        Yields (index, data) for the chunks from first_index to last_index.
+        Raises BlobNotFound if the blob is missing from the backend.
+        """
+        raise NotImplementedError
+
+    def rewrite(self, blob, transform):
+        """
+        Replaces every chunk with transform(index, data) and returns the new
+        location. Must run inside the transaction that saves the location.
+        """
+        raise NotImplementedError
+
+    def delete(self, blob):
+        """
+        Removes the chunks of a deleted blob. Missing chunks are not an error.
+        """
+        raise NotImplementedError
+
+
+class DatabaseBackend(BlobBackend):
+    name = 'db'
+
+    def write(self, blob, chunks):
+        from .models import AttachmentChunk
+
+        batch = []
+        for index, data in chunks:
+            batch.append(AttachmentChunk(blob=blob, index=index, data=data))
+            if len(batch) >= WRITE_BATCH_SIZE:
+                AttachmentChunk.objects.bulk_create(batch)
+                batch = []
+        AttachmentChunk.objects.bulk_create(batch)
+        return ''
+
+    def read(self, blob, first_index, last_index):
+        from .models import AttachmentChunk
+
+        chunks = AttachmentChunk.objects.filter(
+            blob=blob, index__gte=first_index, index__lte=last_index
+        ).order_by('index').values_list('index', 'data')
+        yield from chunks.iterator(chunk_size=4)
+
+    def rewrite(self, blob, transform):
+        from .models import AttachmentChunk
+
+        batch = []
+        chunks = AttachmentChunk.objects.filter(blob=blob).order_by('index')
+        for chunk in chunks.iterator(chunk_size=WRITE_BATCH_SIZE):
+            chunk.data = transform(chunk.index, chunk.data)
+            batch.append(chunk)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                AttachmentChunk.objects.bulk_update(batch, ['data'])
+                batch = []
+        AttachmentChunk.objects.bulk_update(batch, ['data'])
+        return blob.location
+
+    def delete(self, blob):
+        # The chunk rows go with the Blob row (on_delete=CASCADE).
+        pass
+
+
+class FileSystemBackend(BlobBackend):
+    """
+    One file per blob: each chunk is stored as a 4-byte big-endian length
+    followed by the encrypted chunk. Files are never modified in place; a
+    rewrite creates a new file and removes the old one once the transaction
+    that points the blob at the new file has committed.
+    """
+    name = 'fs'
+    _length = struct.Struct('>I')
+
+    def __init__(self, root):
+        self.root = os.fspath(root)
+
+    def path(self, location):
+        return os.path.join(self.root, location)
+
+    def new_location(self, blob):
+        # The random suffix keeps rewrites (and a blob deleted and stored
+        # again) from ever reusing the name of a file still in use.
+        digest = blob.digest
+        return os.path.join(digest[:2], digest[2:4], f"{digest}-{blob.user_id}-{secrets.token_hex(4)}")
+
+    def write(self, blob, chunks):
+        location = self.new_location(blob)
+        path = self.path(location)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.tmp"
+        try:
+            with open(temporary, 'wb') as file:
+                for _, data in chunks:
+                    file.write(self._length.pack(len(data)))
+                    file.write(data)
+            os.replace(temporary, path)
+        except BaseException:
+            self._remove(temporary)
+            raise
+        return location
+
+    def read(self, blob, first_index, last_index):
+        try:
+            file = open(self.path(blob.location), 'rb')
+        except FileNotFoundError:
+            raise BlobNotFound(blob.location)
+        with file:
+            index = 0
+            while index <= last_index:
+                header = file.read(self._length.size)
+                if len(header) < self._length.size:
+                    return
+                (length,) = self._length.unpack(header)
+                if index < first_index:
+                    file.seek(length, os.SEEK_CUR)
+                else:
+                    yield index, file.read(length)
+                index += 1
+
+    def rewrite(self, blob, transform):
+        old_location = blob.location
+        location = self.write(blob, (
+            (index, transform(index, data))
+            for index, data in self.read(blob, 0, blob.chunk_count - 1)
+        ))
+        transaction.on_commit(lambda: self.remove(old_location))
+        return location
+
+    def delete(self, blob):
+        if blob.location:
+            self.remove(blob.location)
+
+    def remove(self, location):
+        self._remove(self.path(location))
+
+    def iter_locations(self, older_than=0):
+        """
+        Yields the location of every stored file (including abandoned
+        temporary files) last modified more than 'older_than' seconds ago.
+        """
+        cutoff = time.time() - older_than
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                try:
+                    if os.path.getmtime(path) <= cutoff:
+                        yield os.path.relpath(path, self.root)
+                except FileNotFoundError:
+                    continue
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {
+    DatabaseBackend.name: DatabaseBackend,
+    FileSystemBackend.name: FileSystemBackend,
+}
+
+
+@functools.cache
+def get_backend(name=None):
+    """
+    Returns the process-wide backend called 'name' ('db' or 'fs'), or the
+    one settings.ATTACHMENT_STORAGE['BACKEND'] selects for new blobs.
+    """
+    name = name or settings.ATTACHMENT_STORAGE['BACKEND']
+    if name == FileSystemBackend.name:
+        return FileSystemBackend(settings.ATTACHMENT_STORAGE['ROOT'])
+    return BACKENDS[name]()
@@ -0,0 +1,46 @@
+"""
+Per-user versions for the cached page fragments (dashboard, notes board,
+calendar). Every fragment key includes its user's current version, and any
+change to the user's notes or tasks replaces the version (see signals.py),
+so all of that user's fragments go stale at once; they are never deleted
+one by one, just left to expire.
+
+Versions live in the 'shared' cache, which every process on the host sees,
+while the fragments themselves (decrypted content) stay in each process's
+memory. A process thus never serves a fragment another process invalidated.
+"""
+import secrets
+
+from django.core.cache import caches
+from django.db import transaction
+
+VERSION_CACHE = 'shared'
+
+
+def _version_key(user_id):
+    return f'notes:cache-version:{user_id}'
+
+
+def user_cache_version(user_id):
+    """
+    Returns the current cache version of a user's pages.
+    """
+    cache = caches[VERSION_CACHE]
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), secrets.token_hex(8), None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def bump_user_cache_version(user_id):
+    """
+    Gives the user's pages a new cache version once the current transaction
+    commits; until then, a page rendered from the old data would be cached
+    under the new version. Versions are random rather than counted, so two
+    processes bumping at once cannot end up on the same version, and a
+    version lost from the cache is never reused.
+    """
+    transaction.on_commit(
+        lambda: caches[VERSION_CACHE].set(_version_key(user_id), secrets.token_hex(8), None)
+    )
@@ -1,40 +1,417 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from django.conf import settings
-from cryptography.fernet import Fernet, InvalidToken
+from django.utils.encoding import force_bytes
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
-# Initialize Fernet with the key from your settings
+# The keyring: settings.FERNET_KEYS, newest first (just FERNET_KEY if unset).
+# New data is always encrypted with the first key; the others only decrypt,
+# so old tokens keep working while `manage.py rotate_keys` re-encrypts them.
 try:
-    f = Fernet(settings.FERNET_KEY)
+    FERNET_KEYS = list(getattr(settings, 'FERNET_KEYS', None) or [settings.FERNET_KEY])
+    _fernets = [Fernet(key) for key in FERNET_KEYS]
+    f = MultiFernet(_fernets)
 except Exception as e:
-    raise ValueError(f"Invalid FERNET_KEY in settings.py. It must be a valid Fernet key. Error: {e}")
+    raise ValueError(f"Invalid FERNET_KEY(S) in settings.py. Each must be a valid Fernet key. Error: {e}")
+
+
+def key_id(key) -> str:
+    """
+    Returns a short, non-secret fingerprint of a keyring key, recorded with
+    data that names the key it was encrypted with (attachments).
+    """
+    return hmac.new(force_bytes(key), b'notes-key-id', hashlib.sha256).hexdigest()[:16]
+
+
+PRIMARY_KEY_ID = key_id(FERNET_KEYS[0])
 
-def encrypt_data(data_str: str) -> str:
+# Separate key for the search blind index. It is derived from FERNET_KEY so
+# there is no extra secret to manage, but it is never used to encrypt anything.
+# It stays tied to FERNET_KEY (not the keyring) because changing it means
+# rebuilding the search index and attachment digests.
+_index_key = hmac.new(force_bytes(settings.FERNET_KEY), b'notes-search-index', hashlib.sha256).digest()
+# Same idea for fingerprinting attachment contents.
+_digest_key = hmac.new(force_bytes(settings.FERNET_KEY), b'notes-content-digest', hashlib.sha256).digest()
+
+# Attachments are encrypted in fixed-size chunks with AES-256-GCM rather than as
+# one Fernet token, so uploads can be encrypted as they are read and downloads
+# (including HTTP Range requests) only decrypt the chunks they need. There is
+# one chunk key per keyring key, looked up by key_id().
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+STREAM_NONCE_SIZE = 7
+_chunk_ciphers = {
+    key_id(key): AESGCM(hmac.new(force_bytes(key), b'notes-attachment-chunks', hashlib.sha256).digest())
+    for key in FERNET_KEYS
+}
+
+# --- Per-user data keys (envelope encryption) ---
+# Each user's notes are encrypted with their own random data key. The data key
+# is stored wrapped (encrypted) by the keyring in UserKey, so rotating the
+# keyring only re-wraps one small row per user, and deleting a user's UserKey
+# makes all of their data unreadable at once.
+
+# Token formats:
+#   "u2:<user id>:<Fernet token>"  the user's data key, storage envelope inside
+#   "u1:<user id>:<Fernet token>"  the user's data key, plain UTF-8 (older)
+#   "<Fernet token>"               the keyring, plain UTF-8 (before data keys)
+USER_TOKEN_PREFIX = 'u2:'
+USER_TOKEN_PREFIXES = ('u1:', 'u2:')
+USER_KEY_ID_PREFIX = 'u:'
+
+# --- Storage envelope ---
+# Plaintext is compressed before it is encrypted when that makes it smaller
+# (compressing ciphertext achieves nothing). The first byte of the envelope
+# says how the rest is stored.
+ENVELOPE_RAW = 0
+ENVELOPE_ZLIB = 1
+# Shorter data does not compress well enough to be worth it.
+MIN_COMPRESS_SIZE = 128
+
+
+def pack_envelope(data: bytes, compress=True) -> bytes:
     """
-    Encrypts a string and returns a URL-safe text token.
+    Wraps plaintext bytes in the storage envelope, compressed with zlib if
+    'compress' and that saves space.
+    """
+    if compress and len(data) >= MIN_COMPRESS_SIZE:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return bytes([ENVELOPE_ZLIB]) + packed
+    return bytes([ENVELOPE_RAW]) + data
+
+
+def unpack_envelope(envelope: bytes) -> bytes:
+    """
+    Returns the plaintext bytes inside a storage envelope.
+    """
+    codec, body = envelope[:1], envelope[1:]
+    if codec == bytes([ENVELOPE_RAW]):
+        return body
+    if codec == bytes([ENVELOPE_ZLIB]):
+        return zlib.decompress(body)
+    raise InvalidToken(f"Unknown storage envelope {codec!r}")
+
+
+class DataKeyCache:
+    """
+    A small thread-safe LRU cache of unwrapped data keys (as ciphers), so
+    the content getter and setter do not hit the database. The time-to-live
+    bounds how long a deleted key stays usable in other processes.
+    """
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return value
+
+    def set(self, user_id, value):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+_data_keys = DataKeyCache(**getattr(settings, 'DATA_KEY_CACHE', {}))
+
+
+def new_wrapped_data_key() -> str:
+    """
+    Returns a new random data key, wrapped with the primary keyring key.
+    """
+    return f.encrypt(Fernet.generate_key()).decode('utf-8')
+
+
+def _user_ciphers(user_id, create=True):
+    """
+    Returns (Fernet, AESGCM) for a user's data key, unwrapping it (and, with
+    'create', generating it) on first use. Raises InvalidToken if the user
+    has no key.
+    """
+    ciphers = _data_keys.get(user_id)
+    if ciphers is None:
+        from .models import UserKey
+
+        data_key = f.decrypt(UserKey.wrapped_key_for(user_id, create=create).encode('utf-8'))
+        ciphers = (
+            Fernet(data_key),
+            AESGCM(hmac.new(data_key, b'notes-attachment-chunks', hashlib.sha256).digest()),
+        )
+        _data_keys.set(user_id, ciphers)
+    return ciphers
+
+
+def forget_user_key(user_id):
+    """
+    Drops a user's unwrapped data key from this process's cache.
+    """
+    _data_keys.discard(user_id)
+
+
+def is_user_token(token) -> bool:
+    return bool(token) and token.startswith(USER_TOKEN_PREFIXES)
+
+
+def _split_token(token):
+    """
+    Returns (user id or None, whether it holds an envelope, Fernet token).
+    """
+    if is_user_token(token):
+        user_id, _, fernet_token = token[3:].partition(':')
+        return int(user_id), token.startswith(USER_TOKEN_PREFIX), fernet_token
+    return None, False, token
+
+
+def encrypt_data(data_str: str, user_id=None) -> str:
+    """
+    Encrypts a string and returns a URL-safe text token. With a user id the
+    user's data key is used (and the text compressed when that pays off),
+    otherwise the keyring.
     """
     if not data_str:
         return ""
     try:
         data_bytes = data_str.encode('utf-8')
-        encrypted_bytes = f.encrypt(data_bytes)
-        return encrypted_bytes.decode('utf-8')
+        if user_id is None:
+            return f.encrypt(data_bytes).decode('utf-8')
+        encrypted_bytes = _user_ciphers(user_id)[0].encrypt(pack_envelope(data_bytes))
+        return f"{USER_TOKEN_PREFIX}{user_id}:{encrypted_bytes.decode('utf-8')}"
     except Exception:
         # Handle encryption errors, though they are rare
         return ""
 
+def _open_token(cipher, enveloped, fernet_token) -> str:
+    plaintext = cipher.decrypt(fernet_token.encode('ascii'))
+    if enveloped:
+        plaintext = unpack_envelope(plaintext)
+    return plaintext.decode('utf-8')
+
+def _decrypt_token(encrypted_token: str) -> str:
+    user_id, enveloped, fernet_token = _split_token(encrypted_token)
+    cipher = f if user_id is None else _user_ciphers(user_id, create=False)[0]
+    return _open_token(cipher, enveloped, fernet_token)
+
 def decrypt_data(encrypted_token: str) -> str:
     """
-    Decrypts a Fernet token (string) and returns the original string.
-    Returns an empty string if decryption fails or token is empty.
+    Decrypts a token (string) and returns the original string. Both user
+    tokens and older keyring tokens are accepted.
+    Returns an empty string if the token is empty.
     """
     if not encrypted_token:
         return ""
     try:
-        encrypted_bytes = encrypted_token.encode('utf-8')
-        decrypted_bytes = f.decrypt(encrypted_bytes)
-        return decrypted_bytes.decode('utf-8')
-    except (InvalidToken, TypeError):
+        return _decrypt_token(encrypted_token)
+    except (InvalidToken, TypeError, ValueError, zlib.error):
         # If the token is invalid or not a string, return a safe value
         return "Decryption Failed: Invalid data."
     except Exception:
         # Catch other potential errors
-        return "Decryption Failed."
\ No newline at end of file
+        return "Decryption Failed."
+
+# --- Batch decryption ---
+# Batches at least this large are decrypted across a thread pool (the
+# cryptography primitives release the GIL while they work).
+PARALLEL_DECRYPT_MIN = 64
+DECRYPT_WORKERS = min(4, os.cpu_count() or 1)
+
+_decrypt_pool = None
+_decrypt_pool_lock = threading.Lock()
+
+
+def _get_decrypt_pool():
+    global _decrypt_pool
+    with _decrypt_pool_lock:
+        if _decrypt_pool is None:
+            _decrypt_pool = ThreadPoolExecutor(DECRYPT_WORKERS, thread_name_prefix='decrypt')
+        return _decrypt_pool
+
+
+def decrypt_many(tokens, parallel=None):
+    """
+    Decrypts a list of tokens in one call and returns the plaintexts in the
+    same order, with the same results as decrypt_data() for each. Data keys
+    are looked up once per user up front, so worker threads never touch the
+    database. 'parallel' defaults to True for batches of PARALLEL_DECRYPT_MIN
+    tokens or more.
+    """
+    tokens = list(tokens)
+    ciphers = {None: f}
+    for token in tokens:
+        try:
+            user_id = _split_token(token)[0]
+        except ValueError:
+            continue
+        if user_id not in ciphers:
+            try:
+                ciphers[user_id] = _user_ciphers(user_id, create=False)[0]
+            except InvalidToken:
+                ciphers[user_id] = None
+
+    def decrypt_one(token):
+        if not token:
+            return ""
+        try:
+            user_id, enveloped, fernet_token = _split_token(token)
+            cipher = ciphers[user_id]
+            if cipher is None:
+                raise InvalidToken
+            return _open_token(cipher, enveloped, fernet_token)
+        except (InvalidToken, TypeError, ValueError, zlib.error):
+            return "Decryption Failed: Invalid data."
+        except Exception:
+            return "Decryption Failed."
+
+    if parallel is None:
+        parallel = len(tokens) >= PARALLEL_DECRYPT_MIN
+    if parallel and DECRYPT_WORKERS > 1:
+        return list(_get_decrypt_pool().map(decrypt_one, tokens, chunksize=16))
+    return [decrypt_one(token) for token in tokens]
+
+
+def decrypt_attached(objects, get_token, cache_attr, parallel=None):
+    """
+    Decrypts one token per object (get_token(obj)) with decrypt_many() and
+    stores (token, plaintext) on each object as 'cache_attr', where the
+    model's properties find it instead of decrypting again.
+    """
+    objects = list(objects)
+    tokens = [get_token(obj) for obj in objects]
+    for obj, token, plaintext in zip(objects, tokens, decrypt_many(tokens, parallel)):
+        setattr(obj, cache_attr, (token, plaintext))
+    return objects
+
+def rotate_token(token: str, user_id=None):
+    """
+    Re-encrypts a keyring token with the primary key, or, given a user id,
+    moves it to that user's data key. Returns None if there is nothing to do
+    (empty, a user token, or already on the primary key without a user).
+    Raises InvalidToken if no key in the keyring can decrypt it.
+    """
+    if not token or is_user_token(token):
+        return None
+    token_bytes = token.encode('utf-8')
+    if user_id is not None:
+        return encrypt_data(f.decrypt(token_bytes).decode('utf-8'), user_id) or None
+    try:
+        _fernets[0].decrypt(token_bytes)
+        return None
+    except InvalidToken:
+        return f.rotate(token_bytes).decode('utf-8')
+
+def upgrade_token(token: str, user_id):
+    """
+    Re-encrypts a token in the current format (the user's data key, storage
+    envelope). Returns None if it already is, or is empty. Raises
+    InvalidToken if it cannot be decrypted.
+    """
+    if not token or token.startswith(f"{USER_TOKEN_PREFIX}{user_id}:"):
+        return None
+    try:
+        plaintext = _decrypt_token(token)
+    except (ValueError, zlib.error):
+        raise InvalidToken
+    return encrypt_data(plaintext, user_id) or None
+
+def blind_index(user_id, term: str) -> str:
+    """
+    Returns a keyed hash (HMAC-SHA256, truncated to 128 bits) of a search term.
+    The user id is mixed in so the same word gives a different token per user.
+    """
+    message = f"{user_id}:{term}".encode('utf-8')
+    return hmac.new(_index_key, message, hashlib.sha256).hexdigest()[:32]
+
+
+def content_digest(data: bytes) -> str:
+    """
+    Returns a keyed hash (HMAC-SHA256, hex) of some plaintext bytes. Unlike a
+    plain SHA-256 it cannot be used to confirm a guess about a file's contents.
+    """
+    hasher = content_hasher()
+    hasher.update(data)
+    return hasher.hexdigest()
+
+
+def content_hasher():
+    """
+    Returns an incremental version of content_digest(): call update() with
+    each piece of the data, then hexdigest().
+    """
+    return hmac.new(_digest_key, digestmod=hashlib.sha256)
+
+
+def new_stream_nonce() -> bytes:
+    """
+    Returns a random nonce prefix for a new chunked (attachment) stream.
+    """
+    return os.urandom(STREAM_NONCE_SIZE)
+
+
+def _chunk_nonce(stream_nonce: bytes, index: int, last: bool) -> bytes:
+    # STREAM construction: prefix || 32-bit chunk counter || last-chunk flag.
+    # The counter stops chunks being reordered and the flag stops truncation.
+    return bytes(stream_nonce) + index.to_bytes(4, 'big') + (b'\x01' if last else b'\x00')
+
+
+def user_key_id(user_id) -> str:
+    """
+    The key id of attachments encrypted with a user's data key.
+    """
+    return f"{USER_KEY_ID_PREFIX}{user_id}"
+
+
+def _chunk_cipher(chunk_key_id):
+    if chunk_key_id.startswith(USER_KEY_ID_PREFIX):
+        return _user_ciphers(int(chunk_key_id[len(USER_KEY_ID_PREFIX):]), create=False)[1]
+    try:
+        return _chunk_ciphers[chunk_key_id]
+    except KeyError:
+        raise InvalidToken(f"Key {chunk_key_id} is not in the keyring")
+
+
+def encrypt_chunk(stream_nonce: bytes, index: int, data: bytes, last: bool, chunk_key_id: str) -> bytes:
+    """
+    Encrypts one chunk of a stream with the key 'chunk_key_id' (normally
+    user_key_id() of the owner). The result carries its own 16-byte tag.
+    """
+    if chunk_key_id.startswith(USER_KEY_ID_PREFIX):
+        cipher = _user_ciphers(int(chunk_key_id[len(USER_KEY_ID_PREFIX):]))[1]
+    else:
+        cipher = _chunk_cipher(chunk_key_id)
+    return cipher.encrypt(_chunk_nonce(stream_nonce, index, last), data, None)
+
+
+def decrypt_chunk(stream_nonce: bytes, index: int, data: bytes, last: bool, chunk_key_id: str) -> bytes:
+    """
+    Decrypts and authenticates one chunk of a stream encrypted with the key
+    'chunk_key_id'. Raises InvalidToken if the chunk was tampered with or is
+    out of place, or the key no longer exists.
+    """
+    try:
+        return _chunk_cipher(chunk_key_id).decrypt(_chunk_nonce(stream_nonce, index, last), bytes(data), None)
+    except InvalidTag:
+        raise InvalidToken
@@ -1,10 +1,11 @@
 from django import forms
 from .models import Note, Task
-from .crypt import encrypt_data, decrypt_data # Import our functions
 
 class NoteForm(forms.ModelForm):
     # (This form is unchanged)
-    content = forms.CharField(widget=forms.Textarea(attrs={'rows': 10}), required=False, label="Content")
+    # Not stripped: content is compared with the stored content on save (an
+    # unchanged note is not written again), and leading indentation matters.
+    content = forms.CharField(widget=forms.Textarea(attrs={'rows': 10}), required=False, strip=False, label="Content")
     attachment = forms.FileField(required=False, label="Attachment")
     
     class Meta:
@@ -20,9 +21,14 @@ class NoteForm(forms.ModelForm):
                 self.fields['attachment'].label = "Replace current file:"
                 self.fields['attachment'].help_text = f"Current: {self.instance.attachment_name}"
 
+    def clean_content(self):
+        # Browsers post textarea lines ending in \r\n; autosave and saved chat
+        # replies store \n. Storing \n only keeps an unchanged note unchanged.
+        return self.cleaned_data['content'].replace('\r\n', '\n')
+
     def save(self, commit=True):
         note = super().save(commit=False)
-        note.encrypted_content = encrypt_data(self.cleaned_data['content'])
+        note.content = self.cleaned_data['content']
         
         uploaded_file = self.cleaned_data.get('attachment')
         if uploaded_file:
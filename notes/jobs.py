@@ -0,0 +1,151 @@
+"""
+Background jobs: work that should not hold up a request (model calls,
+maintenance) is queued as a Job row and run by `manage.py run_jobs`, which
+any number of processes can run side by side. The browser follows a job
+through the job_status view. Without a worker (JOB_QUEUE['eager']), enqueue()
+runs each job at once instead, in the process that queues it.
+
+A job's kind names its handler in HANDLERS. A handler takes the claimed Job
+and returns a JSON-serializable result; if it raises, the job is retried
+with backoff (see Job.fail).
+"""
+import functools
+import io
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+HANDLERS = {
+    'chat': 'notes.views.chat_job',
+    'maintenance': 'notes.jobs.maintenance_job',
+}
+# Commands a 'maintenance' job may run.
+MAINTENANCE_COMMANDS = frozenset({
+    'compress_storage', 'gc_blobs', 'rebuild_search_index', 'rotate_keys', 'summarize_notes',
+})
+
+logger = logging.getLogger(__name__)
+
+
+@functools.cache
+def get_handler(kind):
+    return import_string(HANDLERS[kind])
+
+
+def run_job(job):
+    """
+    Runs a claimed job and records how it went.
+    """
+    try:
+        result = get_handler(job.kind)(job)
+    except Exception as e:
+        logger.exception("Job %s failed (attempt %s of %s)", job.pk, job.attempts, job.max_attempts)
+        job.fail(e)
+    else:
+        job.finish(result)
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=None):
+    """
+    Queues a job for the workers and returns it. With JOB_QUEUE['eager'] the
+    job is run here and now instead, in a single attempt (nothing would run
+    a retry), and returned done or failed, unless a worker claimed it first.
+    """
+    if not settings.JOB_QUEUE['eager']:
+        return Job.enqueue(kind, payload, user=user, max_attempts=max_attempts)
+    job = Job.enqueue(kind, payload, user=user, max_attempts=1)
+    claimed = Job.claim(f"eager:{socket.gethostname()}:{os.getpid()}", pk=job.pk)
+    if claimed is not None:
+        run_job(claimed)
+    job.refresh_from_db()
+    return job
+
+
+def maintenance_job(job):
+    """
+    Runs one of the MAINTENANCE_COMMANDS, e.g.
+    enqueue('maintenance', {'command': 'gc_blobs', 'options': {'grace': 600}}).
+    """
+    payload = job.payload
+    if payload.get('command') not in MAINTENANCE_COMMANDS:
+        raise ValueError(f"Not a maintenance command: {payload.get('command')!r}")
+    output = io.StringIO()
+    call_command(payload['command'], stdout=output, **payload.get('options', {}))
+    return {'output': output.getvalue()[-2000:]}
+
+
+class Worker:
+    """
+    Runs jobs in 'concurrency' threads until stopped (or, with 'burst', until
+    no job is ready). Each thread claims one job at a time.
+    """
+    def __init__(self, concurrency=None, poll_interval=None, burst=False, name=None):
+        options = settings.JOB_QUEUE
+        self.concurrency = concurrency or options['concurrency']
+        self.poll_interval = poll_interval or options['poll_interval']
+        self.burst = burst
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        self._stale_lock = threading.Lock()
+        self._stale_checked = 0.0
+
+    def stop(self):
+        """
+        Lets the running jobs finish, then returns from run().
+        """
+        self.stopping.set()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self._work, args=(f"{self.name}:{number}",), daemon=True)
+            for number in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # A timeout keeps the main thread responsive to signals.
+            while thread.is_alive():
+                thread.join(timeout=1)
+
+    def _work(self, name):
+        try:
+            while not self.stopping.is_set():
+                close_old_connections()
+                try:
+                    self._requeue_stale()
+                    job = Job.claim(name)
+                    if job is not None:
+                        run_job(job)
+                        continue
+                except Exception:
+                    # E.g. the database being unavailable for a moment. A
+                    # job whose outcome was not saved is requeued as stale.
+                    logger.exception("Worker %s could not run a job", name)
+                else:
+                    if self.burst:
+                        break
+                self.stopping.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def _requeue_stale(self):
+        # One thread per process checks, at most once a minute.
+        stale_after = settings.JOB_QUEUE['stale_after']
+        with self._stale_lock:
+            if time.monotonic() - self._stale_checked < min(stale_after, 60):
+                return
+            self._stale_checked = time.monotonic()
+        requeued = Job.requeue_stale(timezone.now() - timedelta(seconds=stale_after))
+        if requeued:
+            logger.warning("Requeued %s job(s) left running by a stopped worker", requeued)
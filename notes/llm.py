@@ -0,0 +1,411 @@
+"""
+Backends for the AI chat, plus a cache of model responses.
+
+The backend class is chosen with settings.AI_BACKEND (a dotted path) and is
+created once per process:
+
+- GeminiBackend talks to Google Gemini (settings.AI_MODEL_NAME).
+- LocalBackend answers deterministically without any network access, for
+  tests, offline development and load-testing the chat path.
+
+generate() and stream() put replies in a content-addressed cache keyed by the
+model, the prompt and a hash of the note content used as context, so asking
+the same thing about the same note again does not call the model.
+
+fit_context() keeps note context inside settings.AI_CONTEXT_BUDGET by
+summarizing the pieces of an oversized note first (map-reduce).
+summarize_note() makes the short note summaries precomputed for list pages.
+"""
+import asyncio
+import functools
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class ChatBackend:
+    """
+    Interface of a chat backend. Subclasses implement generate(); astream()
+    falls back to returning the whole reply as a single piece.
+    """
+    model_name = ''
+
+    def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    async def astream(self, prompt: str):
+        yield await sync_to_async(self.generate, thread_sensitive=False)(prompt)
+
+
+class GeminiBackend(ChatBackend):
+    """
+    Google Gemini through the google-generativeai package.
+    """
+    def __init__(self, model_name=None, api_key=None):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key or settings.GOOGLE_API_KEY)
+        self.model_name = model_name or settings.AI_MODEL_NAME
+        self.model = genai.GenerativeModel(self.model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    async def astream(self, prompt):
+        response = await self.model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class LocalBackend(ChatBackend):
+    """
+    A deterministic stand-in model: it echoes the prompt back, a few words at
+    a time. 'delay' (seconds per piece) can simulate a slow model.
+    """
+    model_name = 'local-echo'
+    WORDS_PER_PIECE = 3
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def _pieces(self, prompt):
+        words = f"You said: {prompt}".split(' ')
+        step = self.WORDS_PER_PIECE
+        return [' '.join(words[i:i + step]) + ' ' for i in range(0, len(words), step)]
+
+    def generate(self, prompt):
+        pieces = self._pieces(prompt)
+        if self.delay:
+            time.sleep(self.delay * len(pieces))
+        return ''.join(pieces)
+
+    async def astream(self, prompt):
+        for piece in self._pieces(prompt):
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            yield piece
+
+
+class ResponseCache:
+    """
+    A small thread-safe LRU cache with a time-to-live, for model replies.
+    """
+    def __init__(self, max_entries=256, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name, prompt, context='', history=''):
+        """
+        Returns the cache key for a prompt asked with some context (note text)
+        and conversation history. Only hashes are kept, not the prompt or the
+        note itself.
+        """
+        context_hash = hashlib.sha256(context.encode('utf-8')).hexdigest()
+        parts = [model_name, prompt, context_hash]
+        if history:
+            parts.append(hashlib.sha256(history.encode('utf-8')).hexdigest())
+        material = '\0'.join(parts)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@functools.cache
+def get_backend():
+    """
+    Returns the process-wide chat backend configured in settings.AI_BACKEND.
+    """
+    backend_class = import_string(settings.AI_BACKEND)
+    return backend_class(**settings.AI_BACKEND_OPTIONS)
+
+
+@functools.cache
+def get_cache():
+    """
+    Returns the process-wide response cache.
+    """
+    return ResponseCache(**settings.AI_RESPONSE_CACHE)
+
+
+@functools.cache
+def get_summary_cache():
+    """
+    Returns the process-wide cache of piece summaries (see fit_context).
+    """
+    return ResponseCache(**settings.AI_SUMMARY_CACHE)
+
+
+@functools.cache
+def get_summary_pool():
+    """
+    Returns the process-wide pool that runs summary calls. Its size bounds
+    the number of concurrent model calls, however many chats need one.
+    """
+    return ThreadPoolExecutor(settings.AI_CONTEXT_BUDGET['workers'], thread_name_prefix='summarize')
+
+
+def build_prompt(prompt, context='', history=''):
+    """
+    Wraps the user's prompt with context from their notes and the
+    conversation so far, if any.
+    """
+    if not context and not history:
+        return prompt
+    parts = []
+    if history:
+        parts.append(
+            f"This is our conversation so far:\n"
+            f"--- CONVERSATION START ---\n"
+            f"{history}\n"
+            f"--- CONVERSATION END ---\n\n"
+        )
+    if context:
+        parts.append(
+            f"Please use the following excerpts from my notes as context:\n"
+            f"--- NOTES START ---\n"
+            f"{context}\n"
+            f"--- NOTES END ---\n\n"
+        )
+    parts.append(f"Now, please respond to this prompt: {prompt}")
+    return ''.join(parts)
+
+
+def generate(prompt, context='', history=''):
+    """
+    Returns the full reply to a prompt asked with some context (blocking).
+    """
+    backend = get_backend()
+    cache = get_cache()
+    key = cache.make_key(backend.model_name, prompt, context, history)
+    reply = cache.get(key)
+    if reply is None:
+        reply = backend.generate(build_prompt(prompt, context, history))
+        cache.set(key, reply)
+    return reply
+
+
+async def stream(prompt, context='', history=''):
+    """
+    Yields the reply to a prompt piece by piece, as the model produces it.
+    A cached reply is yielded as one piece.
+    """
+    backend = get_backend()
+    cache = get_cache()
+    key = cache.make_key(backend.model_name, prompt, context, history)
+    reply = cache.get(key)
+    if reply is not None:
+        yield reply
+        return
+
+    pieces = []
+    async for piece in backend.astream(build_prompt(prompt, context, history)):
+        pieces.append(piece)
+        yield piece
+    cache.set(key, ''.join(pieces))
+
+
+# --- Long contexts ---
+# A note too long for the context budget is map-reduced: split into pieces,
+# each piece summarized on its own (concurrently), and the prompt answered
+# over the joined summaries.
+
+SUMMARY_PROMPT = (
+    "Summarize this part of a longer note. Keep every fact, name, number, date, "
+    "decision and open question, and leave out filler. Reply with the summary only."
+)
+# Rounds of summarizing the summaries before the context is cut off instead.
+MAX_SUMMARY_ROUNDS = 3
+
+
+def count_tokens(text):
+    """
+    Estimates the number of tokens in a text, at about four characters per
+    token, which is close enough for English to budget prompts without asking
+    the model.
+    """
+    return (len(text) + 3) // 4
+
+
+def split_for_tokens(text, max_tokens):
+    """
+    Splits text into pieces of at most about max_tokens tokens, at paragraph
+    breaks where possible and at word breaks otherwise.
+    """
+    max_chars = max_tokens * 4
+    pieces, current = [], ''
+    for paragraph in re.split(r'\n\s*\n', text):
+        while len(paragraph) > max_chars:
+            cut = paragraph.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            head, paragraph = paragraph[:cut], paragraph[cut:].lstrip()
+            if current:
+                pieces.append(current)
+                current = ''
+            pieces.append(head)
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            pieces.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def summarize(text):
+    """
+    Returns the model's summary of one piece of a long note. Summaries are
+    cached by a hash of the piece, whatever the question was.
+    """
+    backend = get_backend()
+    cache = get_summary_cache()
+    key = cache.make_key(backend.model_name, SUMMARY_PROMPT, text)
+    summary = cache.get(key)
+    if summary is None:
+        summary = backend.generate(build_prompt(SUMMARY_PROMPT, text))
+        cache.set(key, summary)
+    return summary
+
+
+def fit_context(text, max_tokens=None):
+    """
+    Returns the context unchanged if it fits in max_tokens (estimated), and
+    otherwise a map-reduced version: the summaries of its pieces, summarized
+    again while they are still too long. Pieces are summarized concurrently
+    in the bounded summary pool.
+    """
+    budget = settings.AI_CONTEXT_BUDGET
+    max_tokens = max_tokens or budget['context_tokens']
+    for _ in range(MAX_SUMMARY_ROUNDS):
+        if count_tokens(text) <= max_tokens:
+            return text
+        pieces = split_for_tokens(text, budget['chunk_tokens'])
+        summaries = list(get_summary_pool().map(summarize, pieces))
+        merged = '\n\n'.join(
+            f"(Summary of part {number} of {len(pieces)})\n{summary.strip()}"
+            for number, summary in enumerate(summaries, 1)
+        )
+        if count_tokens(merged) >= count_tokens(text):
+            # The model is not making it any shorter.
+            break
+        text = merged
+    return text[:max_tokens * 4]
+
+
+# --- Note summaries ---
+# Made in batches ahead of time by `manage.py summarize_notes` and shown on
+# the notes board and the dashboard.
+
+NOTE_SUMMARY_PROMPT = (
+    "Summarize this note in one to three sentences for a list of notes: what it "
+    "is about and anything that still needs doing. Reply with the summary only."
+)
+
+
+def note_summary_calls(text):
+    """
+    Estimates how many model calls summarize_note() makes for a note: one,
+    plus one per piece of a note too long for the context budget.
+    """
+    budget = settings.AI_CONTEXT_BUDGET
+    if count_tokens(text) <= budget['context_tokens']:
+        return 1
+    return 1 + len(split_for_tokens(text, budget['chunk_tokens']))
+
+
+def summarize_note(title, text):
+    """
+    Returns a short summary of a whole note. A note too long for the context
+    budget is map-reduced first (see fit_context).
+    """
+    context = fit_context(f"Title: {title}\n{text}")
+    return get_backend().generate(build_prompt(NOTE_SUMMARY_PROMPT, context)).strip()
+
+
+# --- Conversation history ---
+# Recent turns are sent verbatim; once they outgrow the history budget, the
+# oldest are folded into a rolling summary, leaving room for a few more turns
+# before the next fold.
+
+HISTORY_PROMPT = (
+    "Update the summary of our conversation with the newer messages below. Keep "
+    "the facts, decisions, names, numbers and open questions I may refer back to. "
+    "Reply with the updated summary only."
+)
+ROLE_LABELS = {'user': 'User', 'assistant': 'Assistant'}
+
+
+def format_turns(turns):
+    """
+    Formats (role, text) pairs as a transcript.
+    """
+    return '\n\n'.join(f"{ROLE_LABELS.get(role, role)}: {text}" for role, text in turns)
+
+
+def format_history(summary, turns):
+    """
+    Returns the history sent with a prompt: the rolling summary, then the
+    turns it does not cover yet.
+    """
+    parts = []
+    if summary:
+        parts.append(f"(Summary of the earlier conversation)\n{summary}")
+    if turns:
+        parts.append(format_turns(turns))
+    return '\n\n'.join(parts)
+
+
+def compact_history(summary, turns, max_tokens):
+    """
+    Given the rolling summary and the (role, text, tokens) turns after it,
+    returns (summary, number of leading turns folded into it). Nothing is
+    folded while everything fits in max_tokens; otherwise the oldest turns
+    are, keeping the newest ones that fit in half the budget.
+    """
+    if count_tokens(summary) + sum(tokens for _, _, tokens in turns) <= max_tokens:
+        return summary, 0
+    kept = kept_tokens = 0
+    for _, _, tokens in reversed(turns):
+        if kept_tokens + tokens > max_tokens // 2:
+            break
+        kept += 1
+        kept_tokens += tokens
+    folded = len(turns) - kept
+    if not folded:
+        return summary, 0
+
+    material = format_history(summary, [(role, text) for role, text, _ in turns[:folded]])
+    material = fit_context(material, settings.AI_CONTEXT_BUDGET['context_tokens'])
+    summary = get_backend().generate(build_prompt(HISTORY_PROMPT, material)).strip()
+    return fit_context(summary, max_tokens // 2), folded
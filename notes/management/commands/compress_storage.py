@@ -0,0 +1,177 @@
+import os
+import time
+
+from cryptography.fernet import InvalidToken
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from notes.crypt import content_hasher, decrypt_data, upgrade_token
+from notes.management.utils import Progress, batched
+from notes.models import Attachment, AttachmentChunk, Blob, MaintenanceCheckpoint, Note, NoteRender
+from notes.rendering import content_hash
+
+
+class Stats:
+    """
+    Bytes stored before and after, and time spent reading and writing.
+    """
+    def __init__(self):
+        self.plaintext = 0
+        self.stored_before = 0
+        self.stored_after = 0
+        self.read_before = 0.0
+        self.read_after = 0.0
+        self.write = 0.0
+
+    def timed(self, attr, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        setattr(self, attr, getattr(self, attr) + time.perf_counter() - started)
+        return result
+
+    def report(self, label):
+        def rate(seconds):
+            return f"{self.plaintext / max(seconds, 1e-9) / 1e6:.1f} MB/s"
+
+        saved = self.stored_before - self.stored_after
+        percent = 100 * saved / self.stored_before if self.stored_before else 0
+        return (
+            f"{label}: {self.stored_before:,} -> {self.stored_after:,} bytes stored "
+            f"({saved:,} bytes, {percent:.1f}% saved); "
+            f"read {rate(self.read_before)} before, {rate(self.read_after)} after; "
+            f"rewrite {rate(self.write)}"
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrites notes, cached renders and attachments in the compressed storage "
+        "format, in batches and resumably, and reports the space saved and the "
+        "read/write throughput before and after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Notes per batch (and per transaction)."
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore the saved checkpoint and check every note again."
+        )
+
+    def handle(self, *args, **options):
+        notes, failed = self.compress_notes(options['batch_size'], options['restart'])
+        files = self.compress_attachments()
+
+        self.stdout.write(notes.report("Notes"))
+        self.stdout.write(files.report("Attachments"))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f"{failed} field(s) could not be decrypted and were left as they are."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("All data is in the current storage format."))
+
+    def compress_notes(self, batch_size, restart):
+        """
+        Re-encrypts note content and cached renders in the storage envelope,
+        batch by batch like rotate_keys, checkpointing after each batch.
+        """
+        checkpoint = MaintenanceCheckpoint.load('compress_storage:notes')
+        if restart:
+            checkpoint.advance(0)
+        pks = Note.objects.filter(pk__gt=checkpoint.position).order_by('pk').values_list('pk', flat=True)
+        progress = Progress(self, 'notes', pks.count())
+        stats = Stats()
+
+        failed = 0
+        for batch in batched(pks.iterator(chunk_size=batch_size), batch_size):
+            with transaction.atomic():
+                notes = Note.objects.select_for_update().filter(pk__in=batch).only('id', 'user_id', 'encrypted_content')
+                renders = {
+                    render.note_id: render
+                    for render in NoteRender.objects.select_for_update().filter(note_id__in=batch)
+                }
+                changed_notes, changed_renders = [], {}
+                for note in notes:
+                    render = renders.get(note.pk)
+                    fields = [(note, 'encrypted_content')]
+                    if render is not None:
+                        fields += [(render, 'encrypted_preview'), (render, 'encrypted_html')]
+                    for obj, field in fields:
+                        token = getattr(obj, field)
+                        try:
+                            new_token = stats.timed('write', upgrade_token, token, note.user_id)
+                        except InvalidToken:
+                            failed += 1
+                            continue
+                        if new_token is None:
+                            continue
+                        plaintext = stats.timed('read_before', decrypt_data, token)
+                        stats.timed('read_after', decrypt_data, new_token)
+                        stats.plaintext += len(plaintext.encode('utf-8'))
+                        stats.stored_before += len(token)
+                        stats.stored_after += len(new_token)
+
+                        if obj is note:
+                            # Keep a render that was current for the old ciphertext current.
+                            if render is not None and render.content_hash == content_hash(token):
+                                render.content_hash = content_hash(new_token)
+                                changed_renders[render.pk] = render
+                            changed_notes.append(note)
+                        else:
+                            changed_renders[render.pk] = render
+                        setattr(obj, field, new_token)
+
+                Note.objects.bulk_update(changed_notes, ['encrypted_content'])
+                NoteRender.objects.bulk_update(
+                    changed_renders.values(), ['content_hash', 'encrypted_preview', 'encrypted_html']
+                )
+                checkpoint.advance(batch[-1])
+            progress.update(len(batch))
+        return stats, failed
+
+    def compress_attachments(self):
+        """
+        Repacks attachment blobs still in an older storage version, checking
+        each against its digest after the rewrite.
+        """
+        blobs = Blob.objects.filter(storage_version__lt=Blob.STORAGE_VERSION).order_by('pk')
+        progress = Progress(self, 'attachments', blobs.count(), unit='files')
+        stats = Stats()
+
+        for blob in blobs.iterator(chunk_size=50):
+            # A blob shared by several notes is compressed unless one of them
+            # says it is already in a compressed format.
+            compress = all(
+                Attachment.is_compressible(content_type)
+                for content_type in blob.attachments.values_list('content_type', flat=True)
+            )
+            stats.stored_before += self.stored_size(blob)
+            stats.timed('read_before', self.read_digest, blob)
+            stats.timed('write', blob.repack, compress)
+            digest = stats.timed('read_after', self.read_digest, blob)
+            if digest != blob.digest:
+                raise RuntimeError(f"Blob {blob.pk} does not match its digest after repacking")
+            stats.stored_after += self.stored_size(blob)
+            stats.plaintext += blob.size
+            progress.update(1)
+        return stats
+
+    @staticmethod
+    def stored_size(blob):
+        if blob.backend == 'fs':
+            return os.path.getsize(blob.get_backend().path(blob.location))
+        return AttachmentChunk.objects.filter(blob=blob).aggregate(
+            size=Sum(Length('data'))
+        )['size'] or 0
+
+    @staticmethod
+    def read_digest(blob):
+        hasher = content_hasher()
+        for piece in blob.iter_bytes():
+            hasher.update(piece)
+        return hasher.hexdigest()
@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count
+from django.utils import timezone
+
+from notes.models import Note, NoteSearchToken, Task
+from notes.pagination import KeysetPaginator
+from notes.reminders import pending_reminders
+from notes.search import query_tokens
+from notes.views import NOTES_PER_PAGE, TASKS_PER_PAGE
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints the database query plan (EXPLAIN) of the hot queries behind each "
+        "view and warns about any that scan a whole table instead of using an index."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, default=1,
+            help="User id to build the queries for (the user does not need to exist)."
+        )
+        parser.add_argument(
+            '--fail-on-scan', action='store_true',
+            help="Exit with an error if any query falls back to a full table scan."
+        )
+
+    def view_queries(self, user_id):
+        """
+        Returns (label, queryset) pairs mirroring the queries of notes/views.py.
+        """
+        now = timezone.now()
+        today = timezone.localdate()
+        day_start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+        tokens = query_tokens(user_id, 'meeting notes')
+        notes_board = KeysetPaginator(
+            Note.objects.filter(user_id=user_id).select_related('attachment', 'render'),
+            ('-created_at', '-id'), NOTES_PER_PAGE
+        )
+        task_list = KeysetPaginator(Task.objects.filter(user_id=user_id), ('due_date', 'id'), TASKS_PER_PAGE)
+
+        return [
+            ('home: recent notes',
+                Note.objects.filter(user_id=user_id).order_by('-created_at')[:5]),
+            ('home: upcoming tasks',
+                Task.objects.filter(user_id=user_id, due_date__gte=now).order_by('due_date')[:5]),
+            ('home: note count',
+                Note.objects.filter(user_id=user_id).values('pk')),
+            ('note: notes board',
+                notes_board.page_queryset()),
+            ('note: notes board, later page',
+                notes_board.page_queryset([now, 1])),
+            ('chat_view: note picker',
+                Note.objects.filter(user_id=user_id).only('id', 'title').order_by('-created_at')),
+            ('search_notes: blind index lookup',
+                NoteSearchToken.objects.filter(user_id=user_id, token__in=tokens)
+                .values('note').annotate(hits=Count('token')).filter(hits=len(tokens))),
+            ('task: task list',
+                task_list.page_queryset()),
+            ('task: task list, later page',
+                task_list.page_queryset([now, 1])),
+            ('task: task list, previous page',
+                task_list.page_queryset([now, 1], backwards=True)),
+            ('calendar_view: month summary',
+                Task.month_summary(user_id, today.year, today.month, timezone.get_current_timezone(), 3)),
+            ('calendar_day_view: day',
+                Task.objects.filter(
+                    user_id=user_id, due_date__gte=day_start, due_date__lt=day_start + timedelta(days=1)
+                ).order_by('due_date')),
+            ('check_task_notifications: pending reminders',
+                pending_reminders(now, user_id=user_id)),
+        ]
+
+    def handle(self, *args, **options):
+        tables = set(connections['default'].introspection.table_names())
+        scans = []
+        for label, queryset in self.view_queries(options['user']):
+            plan = self.explain(queryset)
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            for line in plan.splitlines():
+                full_scan = self.is_full_scan(line, tables)
+                if full_scan:
+                    scans.append(label)
+                style = self.style.WARNING if full_scan else (lambda text: text)
+                self.stdout.write(style(f"  {line}"))
+            self.stdout.write('')
+
+        if scans:
+            message = "Full table scans in: " + ", ".join(sorted(set(scans)))
+            if options['fail_on_scan']:
+                raise CommandError(message)
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("All queries use an index."))
+
+    @staticmethod
+    def explain(queryset):
+        """
+        Returns the query plan of a queryset as text. Unlike QuerySet.explain()
+        this also works for querysets filtered on window functions.
+        """
+        connection = connections[queryset.db]
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+
+    @staticmethod
+    def is_full_scan(line, tables):
+        """
+        True for a plan line that reads a whole table. SQLite reports those as
+        'SCAN <table>' without an index (scans of subqueries are fine);
+        PostgreSQL as 'Seq Scan'.
+        """
+        if 'Seq Scan' in line:
+            return True
+        words = line.split()
+        if 'SCAN' not in words:
+            return False
+        scanned = words[words.index('SCAN') + 1:]
+        return bool(scanned) and scanned[0] in tables and 'INDEX' not in scanned
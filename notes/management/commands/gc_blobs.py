@@ -0,0 +1,78 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+
+from notes.blobstore import FileSystemBackend, get_backend
+from notes.models import Blob
+
+
+class Command(BaseCommand):
+    help = (
+        "Garbage-collects attachment blobs: corrects reference counts that no "
+        "longer match the attachments using each blob, deletes blobs nothing "
+        "refers to, and removes files of the filesystem backend that no blob "
+        "points to (left behind by interrupted uploads or rolled-back transactions)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=60 * 60,
+            help="Only remove stray files older than this many seconds, so "
+                 "uploads still in progress are left alone."
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report what would be done without changing anything."
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        fixed = self.fix_refcounts(dry_run)
+        deleted = self.delete_unused(dry_run)
+        removed = self.remove_stray_files(options['grace'], dry_run)
+
+        verb = "Would fix" if dry_run else "Fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {fixed} reference count(s); "
+            f"{'would delete' if dry_run else 'deleted'} {deleted} unused blob(s) "
+            f"and {removed} stray file(s)."
+        ))
+
+    def fix_refcounts(self, dry_run):
+        wrong = Blob.objects.annotate(uses=Count('attachments')).exclude(refcount=F('uses'))
+        fixed = 0
+        for blob in wrong.only('id').iterator():
+            if not dry_run:
+                with transaction.atomic():
+                    locked = Blob.objects.select_for_update().get(pk=blob.pk)
+                    locked.refcount = locked.attachments.count()
+                    locked.save(update_fields=['refcount'])
+            fixed += 1
+        return fixed
+
+    def delete_unused(self, dry_run):
+        unused = Blob.objects.filter(refcount=0, attachments__isnull=True).values_list('pk', flat=True)
+        deleted = 0
+        for pk in list(unused):
+            if not dry_run:
+                with transaction.atomic():
+                    # Checked again under the lock: it may have been reused since.
+                    blob = Blob.objects.select_for_update().filter(pk=pk, refcount=0).first()
+                    if blob is None or blob.attachments.exists():
+                        continue
+                    blob.delete()
+            deleted += 1
+        return deleted
+
+    def remove_stray_files(self, grace, dry_run):
+        backend = get_backend(FileSystemBackend.name)
+        known = set(Blob.objects.filter(backend=backend.name).values_list('location', flat=True))
+        removed = 0
+        for location in backend.iter_locations(older_than=grace):
+            if location in known:
+                continue
+            self.stdout.write(f"Stray file: {location}")
+            if not dry_run:
+                backend.remove(location)
+            removed += 1
+        return removed
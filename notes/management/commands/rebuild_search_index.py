@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from notes.management.utils import batched
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the encrypted search index and the chat's passage vectors "
+        "for every note (or one user's notes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Only re-index notes of this user id.")
+
+    def handle(self, *args, **options):
+        notes = Note.objects.order_by('pk')
+        if options['user']:
+            notes = notes.filter(user_id=options['user'])
+
+        count = 0
+        for batch in batched(notes.iterator(chunk_size=200), 200):
+            for note in Note.decrypt_page(batch, ['content']):
+                note.update_search_index(note.content)
+                note.update_embedding(note.content)
+            count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Re-indexed {count} note(s)."))
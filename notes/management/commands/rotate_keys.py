@@ -0,0 +1,146 @@
+from cryptography.fernet import InvalidToken
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from notes.crypt import FERNET_KEYS, PRIMARY_KEY_ID, USER_KEY_ID_PREFIX, rotate_token
+from notes.management.utils import Progress, batched
+from notes.models import Blob, MaintenanceCheckpoint, Note, NoteRender, UserKey
+from notes.rendering import content_hash
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-wraps every user's data key with the first key of settings.FERNET_KEYS, "
+        "and moves notes, cached renders and attachments still encrypted with the "
+        "keyring itself to their owner's data key. Runs in small batches while the "
+        "site stays up, and resumes where it stopped if interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Notes per batch (and per transaction)."
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help="Ignore the saved checkpoint and check every note again."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"Rotating to key {PRIMARY_KEY_ID} ({len(FERNET_KEYS)} key(s) in the keyring)."
+        )
+        keys_rotated = self.rotate_user_keys(options['batch_size'])
+        notes_rotated, notes_failed = self.rotate_notes(options['batch_size'], options['restart'])
+        files_rotated, files_failed = self.rotate_attachments()
+
+        message = (
+            f"Re-wrapped {keys_rotated} data key(s); re-encrypted {notes_rotated} note field(s) "
+            f"and {files_rotated} attachment(s)."
+        )
+        if notes_failed or files_failed:
+            self.stdout.write(self.style.WARNING(
+                f"{message} {notes_failed} note field(s) and {files_failed} attachment(s) "
+                f"could not be decrypted with any key and were left as they are."
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"{message} Keys other than {PRIMARY_KEY_ID} can now be removed from FERNET_KEYS."
+            ))
+
+    def rotate_user_keys(self, batch_size):
+        """
+        Re-wraps the data keys. This is the only pass a rotation needs once
+        all data is on data keys: one small row per user.
+        """
+        keys = UserKey.objects.order_by('pk').only('id', 'wrapped_key')
+        progress = Progress(self, 'data keys', keys.count())
+        rotated = 0
+        for batch in batched(keys.iterator(chunk_size=batch_size), batch_size):
+            changed = []
+            for key in batch:
+                wrapped_key = rotate_token(key.wrapped_key)
+                if wrapped_key is not None:
+                    key.wrapped_key = wrapped_key
+                    changed.append(key)
+            UserKey.objects.bulk_update(changed, ['wrapped_key'])
+            rotated += len(changed)
+            progress.update(len(batch))
+        return rotated
+
+    def rotate_notes(self, batch_size, restart):
+        """
+        Moves Note.encrypted_content and the NoteRender of each note from the
+        keyring to the owner's data key. Only the primary keys are streamed; each batch of rows is locked,
+        re-encrypted, written with bulk_update and checkpointed in a single
+        transaction, so memory use is bounded by the batch size.
+        """
+        # User tokens are not affected by the keyring, so once this pass has
+        # finished, later rotations only have to check newer notes.
+        checkpoint = MaintenanceCheckpoint.load('rotate_keys:notes-to-data-keys')
+        if restart:
+            checkpoint.advance(0)
+        pks = Note.objects.filter(pk__gt=checkpoint.position).order_by('pk').values_list('pk', flat=True)
+        progress = Progress(self, 'notes', pks.count())
+
+        rotated = failed = 0
+        for batch in batched(pks.iterator(chunk_size=batch_size), batch_size):
+            with transaction.atomic():
+                notes = Note.objects.select_for_update().filter(pk__in=batch).only('id', 'user_id', 'encrypted_content')
+                renders = {
+                    render.note_id: render
+                    for render in NoteRender.objects.select_for_update().filter(note_id__in=batch)
+                }
+                changed_notes, changed_renders = [], {}
+                for note in notes:
+                    render = renders.get(note.pk)
+                    try:
+                        new_content = rotate_token(note.encrypted_content, note.user_id)
+                        if new_content is not None:
+                            # Keep a render that was current for the old ciphertext current.
+                            if render is not None and render.content_hash == content_hash(note.encrypted_content):
+                                render.content_hash = content_hash(new_content)
+                                changed_renders[render.pk] = render
+                            note.encrypted_content = new_content
+                            changed_notes.append(note)
+                            rotated += 1
+                    except InvalidToken:
+                        failed += 1
+                    if render is not None:
+                        try:
+                            for field in ('encrypted_preview', 'encrypted_html'):
+                                new_value = rotate_token(getattr(render, field), note.user_id)
+                                if new_value is not None:
+                                    setattr(render, field, new_value)
+                                    changed_renders[render.pk] = render
+                        except InvalidToken:
+                            # The render is only a cache; rebuilt on next view.
+                            render.content_hash = ''
+                            changed_renders[render.pk] = render
+
+                Note.objects.bulk_update(changed_notes, ['encrypted_content'])
+                NoteRender.objects.bulk_update(
+                    changed_renders.values(), ['content_hash', 'encrypted_preview', 'encrypted_html']
+                )
+                checkpoint.advance(batch[-1])
+            progress.update(len(batch))
+        return rotated, failed
+
+    def rotate_attachments(self):
+        """
+        Re-encrypts the chunks of every attachment blob still on a keyring
+        key with its owner's data key. Each blob records its key, so this
+        pass needs no checkpoint: finished files are not selected again.
+        """
+        blobs = Blob.objects.exclude(key_id__startswith=USER_KEY_ID_PREFIX).order_by('pk')
+        progress = Progress(self, 'attachments', blobs.count(), unit='files')
+
+        rotated = failed = 0
+        for blob in blobs.iterator(chunk_size=50):
+            try:
+                blob.rotate_key()
+                rotated += 1
+            except InvalidToken:
+                failed += 1
+            progress.update(1)
+        return rotated, failed
@@ -0,0 +1,41 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from notes.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued background jobs (AI replies, maintenance) until stopped. "
+        "Start as many of these as needed; each job is run by one of them. "
+        "On SIGINT/SIGTERM the jobs in progress are finished first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int,
+            help="Jobs run at the same time (threads). Defaults to JOB_QUEUE['concurrency']."
+        )
+        parser.add_argument(
+            '--poll-interval', type=float,
+            help="Seconds an idle thread waits before looking for jobs again."
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help="Exit once no job is ready instead of waiting for more."
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(options['concurrency'], options['poll_interval'], burst=options['burst'])
+
+        def shut_down(signum, frame):
+            self.stdout.write("Finishing the jobs in progress...")
+            worker.stop()
+
+        signal.signal(signal.SIGINT, shut_down)
+        signal.signal(signal.SIGTERM, shut_down)
+
+        self.stdout.write(f"Worker {worker.name} running {worker.concurrency} job(s) at a time.")
+        worker.run()
+        self.stdout.write(self.style.SUCCESS("Worker stopped."))
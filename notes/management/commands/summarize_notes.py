@@ -0,0 +1,117 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from django.utils import timezone
+
+from notes import llm
+from notes.caching import bump_user_cache_version
+from notes.crypt import encrypt_data
+from notes.management.utils import Progress, RateLimiter, batched
+from notes.models import MaintenanceCheckpoint, Note, NoteSummary
+
+CHECKPOINT = 'summarize_notes'
+
+
+class Command(BaseCommand):
+    help = (
+        "Makes the AI summaries shown on the notes board and the dashboard, for "
+        "the notes changed since the last run. Calls the chat model with bounded "
+        "concurrency and at a limited rate. Meant to run nightly (from cron, or "
+        "as a 'maintenance' job)."
+    )
+
+    def add_arguments(self, parser):
+        options = settings.AI_NOTE_SUMMARIES
+        parser.add_argument(
+            '--concurrency', type=int, default=options['concurrency'],
+            help="Notes summarized at the same time."
+        )
+        parser.add_argument(
+            '--rate', type=float, default=options['requests_per_minute'],
+            help="Most model calls per minute."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help="Notes decrypted and saved together."
+        )
+        parser.add_argument('--user', type=int, help="Only summarize notes of this user id.")
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Check every note, not just those changed since the last run."
+        )
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        checkpoint = MaintenanceCheckpoint.load(CHECKPOINT)
+        # Notes without a summary of their current revision (an edit bumps
+        # the revision; an attachment change does not need a new summary).
+        notes = Note.objects.filter(
+            Q(ai_summary__isnull=True) | ~Q(ai_summary__revision=F('revision'))
+        ).order_by('pk')
+        if checkpoint.position and not options['all']:
+            # The checkpoint holds when the last complete run started, in
+            # microseconds since the epoch.
+            since = datetime.datetime.fromtimestamp(checkpoint.position / 1e6, tz=datetime.timezone.utc)
+            notes = notes.filter(updated_at__gte=since)
+        if options['user']:
+            notes = notes.filter(user_id=options['user'])
+
+        self.limiter = RateLimiter(options['rate'])
+        self.min_words = settings.AI_NOTE_SUMMARIES['min_words']
+        progress = Progress(self, 'notes', notes.count())
+        summarized = skipped = failed = 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for batch in batched(notes.iterator(chunk_size=options['batch_size']), options['batch_size']):
+                Note.decrypt_page(batch, ['content'])
+                summaries = []
+                for note, summary in zip(batch, pool.map(self.summarize, batch)):
+                    if summary is None:
+                        skipped += 1
+                    elif isinstance(summary, Exception):
+                        failed += 1
+                        self.stderr.write(f"  note {note.pk}: {summary}")
+                    else:
+                        summaries.append(NoteSummary(
+                            note=note,
+                            revision=note.revision,
+                            encrypted_summary=encrypt_data(summary, note.user_id),
+                            model_name=llm.get_backend().model_name,
+                        ))
+                NoteSummary.objects.bulk_create(
+                    summaries,
+                    update_conflicts=True,
+                    unique_fields=['note'],
+                    update_fields=['revision', 'encrypted_summary', 'model_name', 'updated_at'],
+                )
+                for user_id in {summary.note.user_id for summary in summaries}:
+                    # Their dashboard and notes board now show new summaries.
+                    bump_user_cache_version(user_id)
+                summarized += len(summaries)
+                progress.update(len(batch))
+
+        message = f"Summarized {summarized} note(s); {skipped} too short to need one."
+        if failed:
+            # The checkpoint stays put, so the next run tries these again
+            # (and skips the notes summarized now).
+            self.stdout.write(self.style.WARNING(f"{message} {failed} failed."))
+        else:
+            checkpoint.advance(int(started.timestamp() * 1_000_000))
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def summarize(self, note):
+        """
+        Returns the note's summary, None for a note too short to need one,
+        or the exception the model call raised.
+        """
+        content = note.content or ''
+        if len(content.split()) < self.min_words:
+            # The card preview already shows all of it.
+            return None
+        try:
+            self.limiter.acquire(llm.note_summary_calls(content))
+            return llm.summarize_note(note.title, content)
+        except Exception as e:
+            return e
@@ -0,0 +1,55 @@
+"""
+Helpers shared by the maintenance commands.
+"""
+import threading
+import time
+from itertools import islice
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Progress:
+    """
+    Prints how far a pass has got and how fast it is going.
+    """
+    def __init__(self, command, label, total, unit='rows'):
+        self.command = command
+        self.label = label
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.started = time.monotonic()
+
+    def update(self, count):
+        self.done += count
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        self.command.stdout.write(
+            f"  {self.label}: {self.done}/{self.total} {self.unit} "
+            f"({self.done / elapsed:.1f} {self.unit}/s)"
+        )
+
+
+class RateLimiter:
+    """
+    Spaces calls out to at most 'per_minute' a minute, across threads:
+    acquire() blocks until the caller's turn.
+    """
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self, count=1):
+        """
+        Waits for 'count' calls' worth of the rate.
+        """
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval * count
+        if slot > now:
+            time.sleep(slot - now)
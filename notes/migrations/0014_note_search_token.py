@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:42
+
+import django.db.models.deletion
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.db import migrations, models
+
+
+def index_existing_notes(apps, schema_editor):
+    """
+    Indexes the notes written before the search index existed (their title,
+    and their content if it can be decrypted), so search keeps finding them
+    without running `manage.py rebuild_search_index` after the upgrade.
+    """
+    from notes.search import note_tokens
+
+    Note = apps.get_model('notes', 'Note')
+    NoteSearchToken = apps.get_model('notes', 'NoteSearchToken')
+    f = Fernet(settings.FERNET_KEY)
+
+    for note in Note.objects.only('pk', 'user_id', 'title', 'encrypted_content').iterator(chunk_size=200):
+        try:
+            content = f.decrypt(note.encrypted_content.encode('utf-8')).decode('utf-8') if note.encrypted_content else ''
+        except InvalidToken:
+            content = ''
+        NoteSearchToken.objects.bulk_create(
+            NoteSearchToken(user_id=note.user_id, note_id=note.pk, token=token)
+            for token in note_tokens(note.user_id, f"{note.title}\n{content}")
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0013_remove_task_parent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='notes.note')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'token'], name='notes_search_user_token_idx')],
+                'constraints': [models.UniqueConstraint(fields=('note', 'token'), name='notes_search_unique_note_token')],
+            },
+        ),
+        migrations.RunPython(index_existing_notes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:43
+
+import mimetypes
+
+import django.db.models.deletion
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_attachments(apps, schema_editor):
+    """
+    Copies each note's inline encrypted file into its own Attachment row.
+    The ciphertext is copied as-is; it is only decrypted to fill in the size
+    and digest metadata.
+    """
+    from notes.crypt import content_digest
+
+    Note = apps.get_model('notes', 'Note')
+    Attachment = apps.get_model('notes', 'Attachment')
+    f = Fernet(settings.FERNET_KEY)
+
+    notes = Note.objects.exclude(encrypted_attachment__isnull=True).only('pk', 'attachment_name', 'encrypted_attachment')
+    for note in notes.iterator(chunk_size=20):
+        encrypted_bytes = bytes(note.encrypted_attachment)
+        if not encrypted_bytes:
+            continue
+        try:
+            file_bytes = f.decrypt(encrypted_bytes)
+        except InvalidToken:
+            file_bytes = b''
+        name = note.attachment_name or 'attachment'
+        Attachment.objects.create(
+            note_id=note.pk,
+            name=name,
+            content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream',
+            size=len(file_bytes),
+            digest=content_digest(file_bytes),
+            encrypted_data=encrypted_bytes,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0014_note_search_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('content_type', models.CharField(default='application/octet-stream', max_length=100)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('digest', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('encrypted_data', models.BinaryField()),
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='attachment', to='notes.note')),
+            ],
+        ),
+        migrations.RunPython(move_attachments, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='note',
+            name='attachment_name',
+        ),
+        migrations.RemoveField(
+            model_name='note',
+            name='encrypted_attachment',
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:45
+
+import hashlib
+import hmac
+import logging
+import os
+
+import django.db.models.deletion
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.encoding import force_bytes
+
+CHUNK_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def split_into_chunks(apps, schema_editor):
+    """
+    Re-encrypts each single-token Fernet attachment as a chunked AES-GCM
+    stream. The crypto is spelled out here (matching notes.crypt at the time
+    of this migration) so later changes to notes.crypt cannot break it.
+
+    An attachment that cannot be decrypted (as in 0015) is logged and left
+    empty rather than stopping the migration.
+    """
+    Attachment = apps.get_model('notes', 'Attachment')
+    AttachmentChunk = apps.get_model('notes', 'AttachmentChunk')
+    f = Fernet(settings.FERNET_KEY)
+    cipher = AESGCM(hmac.new(force_bytes(settings.FERNET_KEY), b'notes-attachment-chunks', hashlib.sha256).digest())
+
+    for attachment in Attachment.objects.iterator(chunk_size=1):
+        try:
+            file_bytes = f.decrypt(bytes(attachment.encrypted_data))
+        except InvalidToken:
+            logger.warning("Attachment %s could not be decrypted; it is left empty.", attachment.pk)
+            Attachment.objects.filter(pk=attachment.pk).update(size=0, chunk_count=0)
+            continue
+        nonce = os.urandom(7)
+        pieces = [file_bytes[i:i + CHUNK_SIZE] for i in range(0, len(file_bytes), CHUNK_SIZE)] or [b'']
+        AttachmentChunk.objects.bulk_create(
+            AttachmentChunk(
+                attachment_id=attachment.pk,
+                index=index,
+                data=cipher.encrypt(
+                    nonce + index.to_bytes(4, 'big') + (b'\x01' if index == len(pieces) - 1 else b'\x00'),
+                    piece,
+                    None,
+                ),
+            )
+            for index, piece in enumerate(pieces)
+        )
+        Attachment.objects.filter(pk=attachment.pk).update(nonce=nonce, chunk_count=len(pieces))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0015_attachment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='chunk_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='nonce',
+            field=models.BinaryField(default=b'', max_length=16),
+        ),
+        migrations.CreateModel(
+            name='AttachmentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('attachment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.attachment')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('attachment', 'index'), name='notes_attachment_chunk_unique_index')],
+            },
+        ),
+        migrations.RunPython(split_into_chunks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='encrypted_data',
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0016_attachment_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteRender',
+            fields=[
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='render', serialize=False, to='notes.note')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('encrypted_preview', models.TextField(blank=True)),
+                ('encrypted_html', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0020_keyset_note_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
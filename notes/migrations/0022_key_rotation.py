@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-17 21:59
+
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.encoding import force_bytes
+
+
+def set_key_id(apps, schema_editor):
+    """
+    Existing attachments were encrypted with FERNET_KEY. The fingerprint is
+    computed here (matching notes.crypt.key_id) so later changes to
+    notes.crypt cannot break this migration.
+    """
+    Attachment = apps.get_model('notes', 'Attachment')
+    key_id = hmac.new(force_bytes(settings.FERNET_KEY), b'notes-key-id', hashlib.sha256).hexdigest()[:16]
+    Attachment.objects.update(key_id=key_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0021_note_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaintenanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='key_id',
+            field=models.CharField(default='', max_length=16),
+        ),
+        migrations.RunPython(set_key_id, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0023_user_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='storage_version',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
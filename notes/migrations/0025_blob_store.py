@@ -0,0 +1,129 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_to_blobs(apps, schema_editor):
+    """
+    Gives every distinct file of a user one Blob. The first attachment with
+    a digest keeps its chunks; identical copies attached to other notes of
+    the same user share that blob and their chunks are dropped.
+    """
+    Attachment = apps.get_model('notes', 'Attachment')
+    AttachmentChunk = apps.get_model('notes', 'AttachmentChunk')
+    Blob = apps.get_model('notes', 'Blob')
+
+    blobs = {}
+    for attachment in Attachment.objects.select_related('note').order_by('pk').iterator():
+        key = (attachment.note.user_id, attachment.digest)
+        blob = blobs.get(key)
+        if blob is None:
+            blob = Blob.objects.create(
+                user_id=attachment.note.user_id,
+                digest=attachment.digest,
+                size=attachment.size,
+                nonce=attachment.nonce,
+                chunk_count=attachment.chunk_count,
+                key_id=attachment.key_id,
+                storage_version=attachment.storage_version,
+                backend='db',
+                refcount=0,
+            )
+            AttachmentChunk.objects.filter(attachment=attachment).update(blob=blob)
+            blobs[key] = blob
+        else:
+            AttachmentChunk.objects.filter(attachment=attachment).delete()
+        blob.refcount += 1
+        blob.save(update_fields=['refcount'])
+        attachment.blob = blob
+        attachment.save(update_fields=['blob'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0024_storage_envelope'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('nonce', models.BinaryField(default=b'', max_length=16)),
+                ('chunk_count', models.PositiveIntegerField(default=0)),
+                ('key_id', models.CharField(default='', max_length=16)),
+                ('storage_version', models.PositiveSmallIntegerField(default=1)),
+                ('backend', models.CharField(default='db', max_length=10)),
+                ('location', models.CharField(blank=True, default='', max_length=255)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'digest'), name='notes_blob_unique_user_digest')],
+            },
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='attachments', to='notes.blob'),
+        ),
+        migrations.AddField(
+            model_name='attachmentchunk',
+            name='blob',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.blob'),
+        ),
+        migrations.RunPython(move_to_blobs, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name='attachmentchunk',
+            name='notes_attachment_chunk_unique_index',
+        ),
+        migrations.RemoveField(
+            model_name='attachmentchunk',
+            name='attachment',
+        ),
+        migrations.AlterField(
+            model_name='attachmentchunk',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='notes.blob'),
+        ),
+        migrations.AddConstraint(
+            model_name='attachmentchunk',
+            constraint=models.UniqueConstraint(fields=('blob', 'index'), name='notes_blob_chunk_unique_index'),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='attachments', to='notes.blob'),
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='chunk_count',
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='digest',
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='key_id',
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='nonce',
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='size',
+        ),
+        migrations.RemoveField(
+            model_name='attachment',
+            name='storage_version',
+        ),
+    ]
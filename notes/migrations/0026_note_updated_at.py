@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def set_updated_at(apps, schema_editor):
+    """
+    Existing notes have no edit history; their creation time is the best
+    known modification time.
+    """
+    Note = apps.get_model('notes', 'Note')
+    Note.objects.update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0025_blob_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(set_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0026_note_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteEmbedding',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveSmallIntegerField(default=0)),
+                ('chunk_count', models.PositiveIntegerField(default=0)),
+                ('encrypted_vectors', models.TextField(blank=True, default='')),
+                ('encrypted_chunks', models.TextField(blank=True, default='')),
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='embedding', to='notes.note')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'version'], name='notes_embedding_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 22:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0029_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteSummary',
+            fields=[
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ai_summary', serialize=False, to='notes.note')),
+                ('revision', models.PositiveIntegerField()),
+                ('encrypted_summary', models.TextField(blank=True, default='')),
+                ('model_name', models.CharField(blank=True, default='', max_length=100)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -1,14 +1,29 @@
-from django.db import models
-from django.contrib.auth.models import User
-from .crypt import encrypt_data, decrypt_data
-from cryptography.fernet import Fernet, InvalidToken
+import itertools
+import json
+import random
+from datetime import datetime, timedelta
+
 from django.conf import settings
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import ExtractDay, RowNumber
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+import mimetypes
 
-# Get the raw Fernet object for byte encryption
-try:
-    f = Fernet(settings.FERNET_KEY)
-except Exception as e:
-    raise ValueError(f"Invalid FERNET_KEY in settings.py. It must be a valid Fernet key. Error: {e}")
+from .crypt import (
+    ATTACHMENT_CHUNK_SIZE, encrypt_data, decrypt_data, decrypt_attached, decrypt_many, content_hasher,
+    USER_KEY_ID_PREFIX, new_stream_nonce, encrypt_chunk, decrypt_chunk, user_key_id,
+    new_wrapped_data_key, rotate_token, forget_user_key, pack_envelope, unpack_envelope,
+)
+from .blobstore import get_backend as get_blob_backend
+from .caching import bump_user_cache_version
+from .llm import count_tokens
+from .retrieval import EMBEDDING_VERSION, PassageRanker, chunk_text, decode_vectors, embed, encode_vectors
+from .search import note_tokens
+from .rendering import render_markdown, make_preview, content_hash
+from cryptography.fernet import InvalidToken
 
 class Note(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -17,59 +32,769 @@ class Note(models.Model):
     # Rename 'content' to 'encrypted_content'
     encrypted_content = models.TextField(blank=True, null=True, db_column='content')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set by every save that changes the note or its attachment; sent as
+    # Last-Modified by note_detail.
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bumped by every edit of the title or content; autosave uses it to
+    # detect that the note changed since the editor loaded it.
+    revision = models.PositiveIntegerField(default=0)
+
+    # The encrypted file itself lives in the Attachment model (note.attachment)
+    # so that listing notes never pulls file bytes out of the database.
+
+    class Meta:
+        indexes = [
+            # Nearly every query lists one user's notes, newest first. Kept
+            # ascending: read backwards it also orders ties by id descending,
+            # which keyset pagination on (created_at, id) relies on.
+            models.Index(fields=['user', 'created_at'], name='notes_note_user_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_fields()
+        return instance
+
+    def _snapshot_fields(self, field_names=None):
+        """
+        Remembers the values of the loaded (or just saved) fields, so save()
+        can write only the ones that changed.
+        """
+        deferred = self.get_deferred_fields()
+        snapshot = {
+            field.attname: getattr(self, field.attname)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+            and (field_names is None or field.name in field_names or field.attname in field_names)
+        }
+        if field_names is None:
+            self._loaded_values = snapshot
+        else:
+            self._loaded_values = {**getattr(self, '_loaded_values', {}), **snapshot}
+
+    @property
+    def changed_fields(self):
+        """
+        Names of the fields changed since the note was loaded or last saved.
+        Deferred fields count as changed once they have been assigned.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key and (
+                loaded[field.attname] != getattr(self, field.attname)
+                if field.attname in loaded else field.attname in self.__dict__
+            )
+        ]
 
-    # --- NEW/CHANGED FIELDS FOR ENCRYPTED FILE ---
-    # This field will store the encrypted *bytes* of the file
-    encrypted_attachment = models.BinaryField(blank=True, null=True)
-    # This field stores the original file name (e.g., "cat.jpg")
-    attachment_name = models.CharField(max_length=255, blank=True, null=True)
-    
     @property
     def content(self) -> str:
         """
         This 'getter' decrypts the content when you access 'note.content'.
         """
-        return decrypt_data(self.encrypted_content)
+        return self._decrypted(self.encrypted_content, '_decrypted_content')
 
     @content.setter
     def content(self, value: str):
         """
         This 'setter' encrypts the content when you set 'note.content = ...'.
+        Setting the content it already has keeps the current ciphertext, so
+        the field stays unchanged and is not written again.
         """
-        self.encrypted_content = encrypt_data(value)
+        if self.encrypted_content is not None and value == self.content:
+            return
+        self.encrypted_content = encrypt_data(value, self.user_id)
+        self._decrypted_content = (self.encrypted_content, value)
+        # Remember the plaintext so save() can rebuild the search index and
+        # the render cache without decrypting again.
+        self._pending_content = value
 
     def __str__(self):
         return self.title
 
-    # --- NEW METHODS FOR ENCRYPTED FILE ---
+    def save(self, *args, **kwargs):
+        # An update of a loaded note writes only the changed columns (none at
+        # all if nothing changed) instead of every column.
+        changed = self.changed_fields
+        if (changed is not None and not self._state.adding and not args
+                and kwargs.get('update_fields') is None and not kwargs.get('force_insert')):
+            if {'title', 'encrypted_content'} & set(changed):
+                self.revision += 1
+                changed.append('revision')
+            if (changed or hasattr(self, '_pending_attachment')) and 'updated_at' not in changed:
+                # auto_now only applies to the fields being written.
+                changed.append('updated_at')
+            kwargs['update_fields'] = changed
+        super().save(*args, **kwargs)
+        self._snapshot_fields(kwargs.get('update_fields'))
+
+        if hasattr(self, '_pending_attachment'):
+            self._write_attachment(self._pending_attachment)
+            del self._pending_attachment
+        pending_content = getattr(self, '_pending_content', None)
+        if pending_content is not None:
+            self.update_search_index(pending_content)
+            self.update_render(pending_content)
+            self.update_embedding(pending_content)
+            self._pending_content = None
+        elif changed and 'title' in changed:
+            # The title is indexed too.
+            text = self.content
+            self.update_search_index(text)
+            self.update_embedding(text)
+
+    def save_draft(self, revision, title=None, content=None):
+        """
+        Writes an autosaved title and/or content, but only if the note is
+        still at 'revision' (a compare-and-swap in a single UPDATE). Only the
+        fields given are encrypted and written. Returns False, changing
+        nothing, if the note has been saved since.
+        """
+        updates = {}
+        if title is not None:
+            updates['title'] = title
+        if content is not None:
+            updates['encrypted_content'] = encrypt_data(content, self.user_id)
+        updated_at = timezone.now()
+        updated = Note.objects.filter(pk=self.pk, revision=revision).update(
+            revision=revision + 1, updated_at=updated_at, **updates
+        )
+        if not updated:
+            return False
+        # An UPDATE sends no post_save.
+        bump_user_cache_version(self.user_id)
+
+        for name, value in updates.items():
+            setattr(self, name, value)
+        self.revision = revision + 1
+        self.updated_at = updated_at
+        self._snapshot_fields([*updates, 'revision', 'updated_at'])
+        if content is not None:
+            self._decrypted_content = (self.encrypted_content, content)
+            self.update_render(content)
+        if updates:
+            if content is None:
+                content = self.content
+            self.update_search_index(content)
+            self.update_embedding(content)
+        return True
+
+    def update_search_index(self, text=None):
+        """
+        Replaces this note's blind-index postings with tokens for its title and
+        the given plaintext content (decrypted from the row if not given).
+        """
+        if text is None:
+            text = self.content
+        tokens = note_tokens(self.user_id, f"{self.title}\n{text}")
+        self.search_tokens.all().delete()
+        NoteSearchToken.objects.bulk_create(
+            NoteSearchToken(user_id=self.user_id, note=self, token=token)
+            for token in tokens
+        )
+
+    def update_embedding(self, text=None):
+        """
+        Splits the note into passages and stores them with their vectors
+        (both encrypted) for the chat's retrieval (see NoteEmbedding.search).
+        """
+        if text is None:
+            text = self.content
+        chunks = chunk_text(text)
+        vectors = embed([f"{self.title}\n{chunk}" for chunk in chunks])
+        NoteEmbedding.objects.update_or_create(
+            note=self,
+            defaults={
+                'user_id': self.user_id,
+                'version': EMBEDDING_VERSION,
+                'chunk_count': len(chunks),
+                'encrypted_vectors': encrypt_data(encode_vectors(vectors), self.user_id),
+                'encrypted_chunks': encrypt_data(json.dumps(chunks), self.user_id),
+            },
+        )
+
+    # --- RENDER CACHE ---
+
+    def update_render(self, text=None):
+        """
+        Renders the content to HTML once and stores it (encrypted), together
+        with the card preview, keyed by the hash of the current ciphertext.
+        """
+        if text is None:
+            text = self.content
+        html = render_markdown(text)
+        render, _ = NoteRender.objects.update_or_create(
+            note=self,
+            defaults={
+                'content_hash': content_hash(self.encrypted_content),
+                'encrypted_html': encrypt_data(html, self.user_id),
+                'encrypted_preview': encrypt_data(make_preview(html), self.user_id),
+            },
+        )
+        self.render = render
+        return render
+
+    def _current_render(self):
+        """
+        Returns the cached render if it matches the current content, otherwise
+        renders (and caches) the content again.
+        """
+        try:
+            render = self.render
+        except NoteRender.DoesNotExist:
+            render = None
+        if render is None or render.content_hash != content_hash(self.encrypted_content):
+            render = self.update_render()
+        return render
+
+    def _decrypted(self, token, cache_attr):
+        """
+        Decrypts a token, or returns the plaintext decrypt_page() stored.
+        """
+        cached = getattr(self, cache_attr, None)
+        if cached is None or cached[0] != token:
+            cached = (token, decrypt_data(token))
+            setattr(self, cache_attr, cached)
+        return cached[1]
+
+    @property
+    def preview(self):
+        """
+        The first words of the content as plain text, for note cards.
+        Only the short preview is decrypted, never the full content.
+        """
+        return mark_safe(self._decrypted(self._current_render().encrypted_preview, '_decrypted_preview'))
+
+    @property
+    def rendered_html(self):
+        """
+        The content rendered from Markdown to HTML.
+        """
+        return mark_safe(self._decrypted(self._current_render().encrypted_html, '_decrypted_html'))
+
+    def _current_summary(self):
+        """
+        Returns the AI summary if it was made from the current title and
+        content, otherwise None.
+        """
+        try:
+            summary = self.ai_summary
+        except NoteSummary.DoesNotExist:
+            return None
+        return summary if summary.revision == self.revision else None
+
+    @property
+    def ai_summary_text(self):
+        """
+        The AI summary made by `manage.py summarize_notes`, or None if there
+        is none for the current revision yet. Never calls the model.
+        """
+        summary = self._current_summary()
+        if summary is None:
+            return None
+        return self._decrypted(summary.encrypted_summary, '_decrypted_summary')
+
+    @classmethod
+    def decrypt_page(cls, notes, fields=('preview',), parallel=None):
+        """
+        Decrypts 'fields' ('content', 'preview', 'html' and/or 'summary') of a
+        list of notes in one batched step (see crypt.decrypt_many), before a
+        template reads them one note at a time. Returns the notes as a list.
+        """
+        notes = list(notes)
+        if 'content' in fields:
+            decrypt_attached(notes, lambda note: note.encrypted_content, '_decrypted_content', parallel)
+        if 'preview' in fields:
+            decrypt_attached(notes, lambda note: note._current_render().encrypted_preview, '_decrypted_preview', parallel)
+        if 'html' in fields:
+            decrypt_attached(notes, lambda note: note._current_render().encrypted_html, '_decrypted_html', parallel)
+        if 'summary' in fields:
+            summarized = [note for note in notes if note._current_summary() is not None]
+            decrypt_attached(summarized, lambda note: note.ai_summary.encrypted_summary, '_decrypted_summary', parallel)
+        return notes
+
+    # --- METHODS FOR ENCRYPTED FILE ---
+
+    @property
+    def attachment_or_none(self):
+        """
+        Returns the note's Attachment, or None if it has no file.
+        """
+        try:
+            return self.attachment
+        except Attachment.DoesNotExist:
+            return None
+
+    @property
+    def attachment_name(self):
+        """
+        The original file name of the attachment (e.g. "cat.jpg"), if any.
+        """
+        attachment = self.attachment_or_none
+        return attachment.name if attachment else None
 
     def set_attachment(self, file_object):
         """
-        Encrypts and sets the attachment from a file-like object.
+        Sets (or, with None, removes) the attachment from a file-like object.
+        The file is encrypted and stored when the note is saved, because the
+        Attachment row needs the note's primary key.
         """
+        self._pending_attachment = file_object
+
+    def _write_attachment(self, file_object):
+        # Deleting an Attachment releases its blob (see signals).
         if file_object:
-            # Read the raw bytes from the uploaded file
-            file_bytes = file_object.read()
-            # Encrypt the bytes using the raw Fernet object
-            self.encrypted_attachment = f.encrypt(file_bytes)
-            # Store the original file name
-            self.attachment_name = file_object.name
+            Attachment.create_from_file(self, file_object)
         else:
-            self.encrypted_attachment = None
-            self.attachment_name = None
+            Attachment.objects.filter(note=self).delete()
+        self._state.fields_cache.pop('attachment', None)
 
     def get_attachment(self):
         """
         Returns the decrypted bytes and original file name.
+        This holds the whole file in memory; prefer Attachment.iter_bytes().
         """
-        if self.encrypted_attachment:
+        attachment = self.attachment_or_none
+        if attachment:
             try:
-                decrypted_bytes = f.decrypt(self.encrypted_attachment)
-                return decrypted_bytes, self.attachment_name
+                return b''.join(attachment.iter_bytes()), attachment.name
             except InvalidToken:
                 return None, "Decryption Failed"
         return None, None
 
+class Blob(models.Model):
+    """
+    The encrypted contents of a file, stored once per user however many notes
+    it is attached to. Blobs are addressed by a keyed hash of the plaintext
+    and reference counted: every Attachment holds one reference, and a blob
+    is deleted with its last one. Dedup is per user because each user's
+    files are encrypted with their own data key.
+
+    The encrypted chunks live in a storage backend (see blobstore), so
+    loading a Blob never loads file bytes.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blobs')
+    # Keyed hash of the plaintext, so files can be compared without decrypting
+    digest = models.CharField(max_length=64)
+    # Size of the plaintext file in bytes
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Random nonce prefix of the chunked encryption stream
+    nonce = models.BinaryField(max_length=16, default=b'')
+    chunk_count = models.PositiveIntegerField(default=0)
+    # Which key the chunks are encrypted with (see crypt.key_id and crypt.user_key_id)
+    key_id = models.CharField(max_length=16, default='')
+    # 1: chunks hold the plain bytes; 2: each chunk holds a storage envelope
+    # (crypt.pack_envelope), compressed when that pays off.
+    storage_version = models.PositiveSmallIntegerField(default=1)
+    # Where the chunks are: blobstore backend name, and the backend's own
+    # location of the blob (a file path for 'fs', unused for 'db').
+    backend = models.CharField(max_length=10, default='db')
+    location = models.CharField(max_length=255, blank=True, default='')
+    # Number of attachments using this blob
+    refcount = models.PositiveIntegerField(default=0)
+
+    STORAGE_VERSION = 2
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'digest'], name='notes_blob_unique_user_digest'),
+        ]
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.size} bytes, {self.refcount} ref)"
+
+    def get_backend(self):
+        return get_blob_backend(self.backend)
+
+    @classmethod
+    def store(cls, user_id, file_object, compress=True):
+        """
+        Returns the user's blob holding the contents of 'file_object', with
+        one more reference. The file is hashed first; if the user already
+        has it, nothing is encrypted or written. Otherwise it is encrypted
+        chunk by chunk into the configured backend, holding only a few
+        chunks in memory at any time, whatever the size of the file.
+        """
+        hasher = content_hasher()
+        size = 0
+        for piece in file_object.chunks(ATTACHMENT_CHUNK_SIZE):
+            hasher.update(piece)
+            size += len(piece)
+        digest = hasher.hexdigest()
+
+        with transaction.atomic():
+            while True:
+                blob = cls.acquire(user_id, digest)
+                if blob is not None:
+                    return blob
+                blob = cls(
+                    user_id=user_id,
+                    digest=digest,
+                    size=size,
+                    nonce=new_stream_nonce(),
+                    key_id=user_key_id(user_id),
+                    storage_version=cls.STORAGE_VERSION,
+                    backend=get_blob_backend().name,
+                    refcount=1,
+                )
+                try:
+                    with transaction.atomic():
+                        blob.save()
+                    break
+                except IntegrityError:
+                    # Stored by a concurrent upload of the same file; use that one.
+                    continue
+
+            def encrypted_chunks():
+                for index, (data, last) in enumerate(_fixed_size_chunks(file_object, ATTACHMENT_CHUNK_SIZE)):
+                    blob.chunk_count = index + 1
+                    yield index, encrypt_chunk(blob.nonce, index, pack_envelope(data, compress), last, blob.key_id)
+
+            blob.location = blob.get_backend().write(blob, encrypted_chunks())
+            blob.save(update_fields=['location', 'chunk_count'])
+        return blob
+
+    @classmethod
+    def acquire(cls, user_id, digest):
+        """
+        Adds a reference to the user's blob with 'digest' and returns it, or
+        returns None if there is no such blob.
+        """
+        if cls.objects.filter(user_id=user_id, digest=digest).update(refcount=F('refcount') + 1):
+            return cls.objects.get(user_id=user_id, digest=digest)
+        return None
+
+    @classmethod
+    def release(cls, pk):
+        """
+        Drops a reference to a blob, deleting the blob with its last one.
+        """
+        with transaction.atomic():
+            cls.objects.filter(pk=pk, refcount__gt=0).update(refcount=F('refcount') - 1)
+            # Locked, so a concurrent acquire() waits and then finds no blob.
+            unused = cls.objects.select_for_update().filter(pk=pk, refcount=0).first()
+            if unused is not None:
+                unused.delete()
+
+    def iter_bytes(self, start=0, end=None):
+        """
+        Yields the decrypted bytes from 'start' to 'end' (inclusive, like an
+        HTTP Range), decrypting only the chunks that overlap that range.
+        Raises InvalidToken if a chunk fails authentication.
+        """
+        if end is None or end >= self.size:
+            end = self.size - 1
+        if self.size == 0 or start > end:
+            return
+
+        first_index = start // ATTACHMENT_CHUNK_SIZE
+        last_index = end // ATTACHMENT_CHUNK_SIZE
+        for index, data in self.get_backend().read(self, first_index, last_index):
+            plaintext = decrypt_chunk(self.nonce, index, data, index == self.chunk_count - 1, self.key_id)
+            if self.storage_version >= 2:
+                plaintext = unpack_envelope(plaintext)
+            chunk_start = index * ATTACHMENT_CHUNK_SIZE
+            yield plaintext[max(start - chunk_start, 0):end - chunk_start + 1]
+
+    def rotate_key(self):
+        """
+        Re-encrypts chunks still on a keyring key with the owner's data key,
+        in one transaction so readers never see a mix of keys. Returns the
+        number of chunks re-encrypted.
+        """
+        if self.key_id.startswith(USER_KEY_ID_PREFIX):
+            return 0
+        with transaction.atomic():
+            # Lock the row so a concurrent rotation of the same blob waits.
+            current = Blob.objects.select_for_update().only('key_id', 'location').get(pk=self.pk)
+            target_key_id = user_key_id(self.user_id)
+            if current.key_id == target_key_id:
+                self.key_id, self.location = current.key_id, current.location
+                return 0
+
+            # Keeping the stream nonce is safe only because the key always
+            # changes here; the same plaintext is never encrypted twice under
+            # one key and nonce (compare repack()).
+            def transform(index, data):
+                last = index == self.chunk_count - 1
+                plaintext = decrypt_chunk(self.nonce, index, data, last, self.key_id)
+                return encrypt_chunk(self.nonce, index, plaintext, last, target_key_id)
+
+            self.location = self.get_backend().rewrite(self, transform)
+            self.key_id = target_key_id
+            self.save(update_fields=['key_id', 'location'])
+        return self.chunk_count
+
+    def repack(self, compress=True):
+        """
+        Rewrites chunks stored in an older storage_version in the current
+        one (compressed if 'compress' and that pays off), keeping the key.
+        Returns False if the blob was already current.
+
+        The new chunks get a new stream nonce: under the same key and nonce,
+        AES-GCM must never encrypt different plaintexts, and the old
+        ciphertext may live on in backups and free database pages.
+        """
+        if self.storage_version >= self.STORAGE_VERSION:
+            return False
+        with transaction.atomic():
+            current = Blob.objects.select_for_update().only('storage_version').get(pk=self.pk)
+            if current.storage_version >= self.STORAGE_VERSION:
+                return False
+
+            nonce = new_stream_nonce()
+
+            def transform(index, data):
+                last = index == self.chunk_count - 1
+                plaintext = decrypt_chunk(self.nonce, index, data, last, self.key_id)
+                return encrypt_chunk(nonce, index, pack_envelope(plaintext, compress), last, self.key_id)
+
+            self.location = self.get_backend().rewrite(self, transform)
+            self.nonce = nonce
+            self.storage_version = self.STORAGE_VERSION
+            self.save(update_fields=['nonce', 'storage_version', 'location'])
+        return True
+
+class Attachment(models.Model):
+    """
+    A file attached to a note: its name and type, and a reference to the
+    Blob holding the encrypted contents, which may be shared with other
+    notes of the same user.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, related_name='attachment')
+    # RESTRICT: a blob cannot be deleted while attached, except together with
+    # its attachments (when the user is deleted).
+    blob = models.ForeignKey(Blob, on_delete=models.RESTRICT, related_name='attachments')
+    # The original file name (e.g., "cat.jpg")
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # Content types that are compressed already; zlib would only waste time.
+    COMPRESSED_TYPES = (
+        'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/avif', 'image/heic',
+        'video/', 'audio/', 'font/woff',
+        'application/zip', 'application/gzip', 'application/x-gzip', 'application/zstd',
+        'application/x-7z-compressed', 'application/x-rar-compressed', 'application/vnd.rar',
+        'application/x-bzip2', 'application/x-xz', 'application/pdf', 'application/epub+zip',
+        'application/vnd.openxmlformats-officedocument.', 'application/vnd.oasis.opendocument.',
+    )
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def size(self):
+        return self.blob.size
+
+    @property
+    def digest(self):
+        return self.blob.digest
+
+    @staticmethod
+    def guess_content_type(file_name, fallback=None):
+        content_type, _ = mimetypes.guess_type(file_name)
+        return content_type or fallback or 'application/octet-stream'
+
+    @classmethod
+    def is_compressible(cls, content_type):
+        return not content_type.startswith(cls.COMPRESSED_TYPES)
+
+    @classmethod
+    def create_from_file(cls, note, file_object):
+        """
+        Attaches an uploaded file to the note, replacing its current
+        attachment. The contents are only encrypted and stored if the user
+        has no blob with the same contents yet (see Blob.store).
+        """
+        content_type = cls.guess_content_type(file_object.name, getattr(file_object, 'content_type', None))
+        with transaction.atomic():
+            blob = Blob.store(note.user_id, file_object, cls.is_compressible(content_type))
+            # Only now release the current file: re-uploading it reuses its
+            # blob instead of deleting it and storing it again.
+            cls.objects.filter(note=note).delete()
+            return cls.objects.create(note=note, blob=blob, name=file_object.name, content_type=content_type)
+
+    def iter_bytes(self, start=0, end=None):
+        """
+        Yields the decrypted bytes from 'start' to 'end'; see Blob.iter_bytes.
+        """
+        return self.blob.iter_bytes(start, end)
+
+class AttachmentChunk(models.Model):
+    """
+    One encrypted, individually authenticated piece of a blob stored by the
+    'db' backend.
+    """
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['blob', 'index'], name='notes_blob_chunk_unique_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.blob_id}#{self.index}"
+
+def _fixed_size_chunks(file_object, chunk_size):
+    """
+    Re-buffers a file's chunks() into pieces of exactly chunk_size bytes
+    (the last one may be shorter) and yields (data, is_last) pairs. A file
+    always yields at least one piece, even when empty.
+    """
+    buffer = b''
+    pending = None
+    for piece in file_object.chunks(chunk_size):
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            if pending is not None:
+                yield pending, False
+            pending, buffer = buffer[:chunk_size], buffer[chunk_size:]
+    if buffer:
+        if pending is not None:
+            yield pending, False
+        pending = buffer
+    if pending is None:
+        pending = b''
+    yield pending, True
+
+class NoteRender(models.Model):
+    """
+    Cached rendering of a note: the Markdown-to-HTML output and the card
+    preview, both encrypted. 'content_hash' is the hash of the ciphertext
+    they were rendered from; a mismatch means the cache is stale.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='render')
+    content_hash = models.CharField(max_length=64)
+    encrypted_preview = models.TextField(blank=True)
+    encrypted_html = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Render of note {self.note_id}"
+
+class NoteSummary(models.Model):
+    """
+    A short AI summary of a note, encrypted, made in batches by
+    `manage.py summarize_notes` so pages can show it without calling the
+    model. 'revision' is the note revision it was made from; a mismatch
+    means the note has been edited since.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, primary_key=True, related_name='ai_summary')
+    revision = models.PositiveIntegerField()
+    encrypted_summary = models.TextField(blank=True, default='')
+    model_name = models.CharField(max_length=100, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of note {self.note_id}"
+
+class NoteSearchToken(models.Model):
+    """
+    One posting of the encrypted search index: a keyed hash of a word (prefix)
+    that occurs in a note. The plaintext word is never stored.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=32)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'token'], name='notes_search_user_token_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'token'], name='notes_search_unique_note_token'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> note {self.note_id}"
+
+class NoteEmbedding(models.Model):
+    """
+    A note split into passages for the chat's retrieval: the passages (a JSON
+    list) and their vectors (see retrieval.embed), each encrypted as one
+    token. Vectors and passages are kept apart so a search decrypts only the
+    vectors, plus the passages of the few notes that match.
+    """
+    note = models.OneToOneField(Note, on_delete=models.CASCADE, related_name='embedding')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # retrieval.EMBEDDING_VERSION the vectors were made with
+    version = models.PositiveSmallIntegerField(default=0)
+    chunk_count = models.PositiveIntegerField(default=0)
+    encrypted_vectors = models.TextField(blank=True, default='')
+    encrypted_chunks = models.TextField(blank=True, default='')
+
+    # Notes whose vectors are decrypted and scored at once.
+    SEARCH_BATCH_SIZE = 256
+    # Passages worth sending score at least this much.
+    MIN_SCORE = 0.05
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'version'], name='notes_embedding_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.chunk_count} passage(s) of note {self.note_id}"
+
+    @classmethod
+    def search(cls, user_id, query, k=5, note_id=None):
+        """
+        Returns up to k (note title, passage, score) tuples of the user's
+        notes (or of one note) most similar to 'query', best first. Vectors
+        are decrypted and scored SEARCH_BATCH_SIZE notes at a time, so memory
+        use does not grow with the number of notes.
+        """
+        query_vector = embed([query])[0]
+        if not query_vector.any():
+            return []
+        rows = cls.objects.filter(user_id=user_id, version=EMBEDDING_VERSION, chunk_count__gt=0)
+        if note_id is not None:
+            rows = rows.filter(note_id=note_id)
+        rows = rows.order_by('pk').values_list('note_id', 'encrypted_vectors').iterator(
+            chunk_size=cls.SEARCH_BATCH_SIZE
+        )
+
+        ranker = PassageRanker(query_vector, k)
+        while batch := list(itertools.islice(rows, cls.SEARCH_BATCH_SIZE)):
+            note_ids, tokens = zip(*batch)
+            matrices = {}
+            for pk, plaintext in zip(note_ids, decrypt_many(tokens)):
+                try:
+                    matrices[pk] = decode_vectors(plaintext)
+                except ValueError:
+                    # Not decryptable; the note is left out until re-embedded.
+                    continue
+            ranker.add(matrices)
+
+        matches = ranker.results(cls.MIN_SCORE)
+        if not matches:
+            return []
+        embeddings = list(
+            cls.objects.filter(user_id=user_id, note_id__in={pk for pk, _, _ in matches})
+            .select_related('note').only('note_id', 'encrypted_chunks', 'note__title')
+        )
+        passages = {}
+        for embedding, plaintext in zip(embeddings, decrypt_many(e.encrypted_chunks for e in embeddings)):
+            try:
+                passages[embedding.note_id] = (embedding.note.title, json.loads(plaintext))
+            except ValueError:
+                continue
+
+        results = []
+        for pk, index, score in matches:
+            title, chunks = passages.get(pk, ('', []))
+            if index < len(chunks):
+                results.append((title, chunks[index], score))
+        return results
+
 class Task(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
@@ -78,6 +803,422 @@ class Task(models.Model):
     
     # --- The 'parent' field has been REMOVED ---
 
+    class Meta:
+        indexes = [
+            # Task lists, the calendar and reminders all range over one user's due dates
+            models.Index(fields=['user', 'due_date'], name='notes_task_user_due_idx'),
+        ]
+
     def __str__(self):
         # --- Reverted __str__ method ---
-        return f"Schedule for {self.title}"
\ No newline at end of file
+        return f"Schedule for {self.title}"
+
+    @staticmethod
+    def month_bounds(year, month, tz):
+        """
+        Returns the aware [start, end) datetimes of a calendar month in tz.
+        Filtering on this range can use the (user, due_date) index, unlike
+        due_date__year/__month lookups.
+        """
+        start = datetime(year, month, 1, tzinfo=tz)
+        if month == 12:
+            end = datetime(year + 1, 1, 1, tzinfo=tz)
+        else:
+            end = datetime(year, month + 1, 1, tzinfo=tz)
+        return start, end
+
+    @classmethod
+    def month_summary(cls, user, year, month, tz, titles_per_day):
+        """
+        Returns, in one query, the first 'titles_per_day' tasks of each day of
+        a month as dicts with id, title, due_date, day (in tz) and day_count
+        (the total number of tasks that day).
+        """
+        start, end = cls.month_bounds(year, month, tz)
+        day = ExtractDay('due_date', tzinfo=tz)
+        return cls.objects.filter(
+            user=user,
+            due_date__gte=start,
+            due_date__lt=end
+        ).annotate(
+            day=day,
+            day_rank=Window(RowNumber(), partition_by=[day], order_by=[F('due_date').asc(), F('id').asc()]),
+            day_count=Window(Count('id'), partition_by=[day]),
+        ).filter(
+            day_rank__lte=titles_per_day
+        ).values('id', 'title', 'due_date', 'day', 'day_count').order_by('due_date', 'id')
+
+class TaskReminder(models.Model):
+    """
+    Ledger of delivered task reminders: a row means the reminder for this
+    task (at this due date) has been sent. Rows are pruned once the task is
+    past due, so the table only holds reminders inside the current window.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    task = models.OneToOneField(Task, on_delete=models.CASCADE, related_name='reminder')
+    # The task's due date when the reminder was sent, used for pruning
+    due_date = models.DateTimeField()
+    delivered_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['due_date'], name='notes_reminder_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Reminder for task {self.task_id}"
+
+    @classmethod
+    def record(cls, tasks):
+        """
+        Marks the reminders for these tasks as delivered.
+        """
+        cls.objects.bulk_create(
+            [cls(user_id=task.user_id, task_id=task.pk, due_date=task.due_date) for task in tasks],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def prune(cls, now, user=None):
+        """
+        Deletes ledger rows of tasks that are past due.
+        """
+        expired = cls.objects.filter(due_date__lte=now)
+        if user is not None:
+            expired = expired.filter(user=user)
+        expired.delete()
+
+class UserKey(models.Model):
+    """
+    A user's data key, wrapped (encrypted) with the keyring; see crypt.py.
+    Deleting it makes everything encrypted with it unreadable.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='data_key')
+    wrapped_key = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Data key of user {self.user_id}"
+
+    @classmethod
+    def wrapped_key_for(cls, user_id, create=True):
+        """
+        Returns the user's wrapped data key, generating one if needed (and
+        allowed by 'create'; otherwise raises InvalidToken).
+        """
+        try:
+            return cls.objects.values_list('wrapped_key', flat=True).get(user_id=user_id)
+        except cls.DoesNotExist:
+            if not create:
+                raise InvalidToken(f"User {user_id} has no data key")
+        key, _ = cls.objects.get_or_create(user_id=user_id, defaults={'wrapped_key': new_wrapped_data_key()})
+        return key.wrapped_key
+
+    def rewrap(self):
+        """
+        Re-wraps the data key with the primary keyring key. The data it
+        protects is untouched. Returns False if it already was.
+        """
+        wrapped_key = rotate_token(self.wrapped_key)
+        if wrapped_key is None:
+            return False
+        self.wrapped_key = wrapped_key
+        self.save(update_fields=['wrapped_key'])
+        return True
+
+    def shred(self):
+        """
+        Deletes the key, and with it access to all of the user's notes and
+        files. Other processes drop their cached copy within
+        DATA_KEY_CACHE['ttl'] seconds.
+        """
+        self.delete()
+        forget_user_key(self.user_id)
+
+class MaintenanceCheckpoint(models.Model):
+    """
+    Where a long-running maintenance job (e.g. rotate_keys) got to, so it can
+    resume after being interrupted instead of starting over.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    # Last primary key processed
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.position}"
+
+    @classmethod
+    def load(cls, name):
+        checkpoint, _ = cls.objects.get_or_create(name=name)
+        return checkpoint
+
+    def advance(self, position):
+        self.position = position
+        self.save(update_fields=['position', 'updated_at'])
+
+
+class Conversation(models.Model):
+    """
+    A chat with the AI assistant. Its turns are stored encrypted in ChatTurn.
+    Turns before 'summarized_through' have been folded into the (encrypted)
+    rolling summary, which is sent to the model instead of them, so prompts
+    stay bounded however long the conversation gets.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    encrypted_summary = models.TextField(blank=True, default='')
+    # Index of the first turn not in the summary
+    summarized_through = models.PositiveIntegerField(default=0)
+    turn_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # The chat page opens the user's latest conversation.
+            models.Index(fields=['user', 'updated_at'], name='notes_conversation_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"Conversation {self.pk} ({self.turn_count} turns)"
+
+    @property
+    def summary(self):
+        return decrypt_data(self.encrypted_summary)
+
+    @classmethod
+    def latest_turns(cls, user):
+        """
+        Returns every turn of the user's most recent conversation (with the
+        conversation attached to each), decrypted, in one query.
+        """
+        latest = cls.objects.filter(user=user).order_by('-updated_at').values('pk')[:1]
+        turns = ChatTurn.objects.filter(conversation=models.Subquery(latest)).select_related('conversation')
+        return ChatTurn.decrypt_all(turns.order_by('index'))
+
+    def recent_turns(self):
+        """
+        Returns the turns not folded into the summary yet, decrypted.
+        """
+        return ChatTurn.decrypt_all(self.turns.filter(index__gte=self.summarized_through).order_by('index'))
+
+    def add_turns(self, *turns):
+        """
+        Appends (role, text) turns, saving the conversation first if it is
+        new. Concurrent requests to the same conversation are serialized so
+        turn indexes never collide.
+        """
+        with transaction.atomic():
+            if self.pk is None:
+                self.save()
+            current = Conversation.objects.select_for_update().only('turn_count').get(pk=self.pk)
+            index = current.turn_count
+            ChatTurn.objects.bulk_create(
+                ChatTurn(
+                    conversation=self,
+                    index=index + offset,
+                    role=role,
+                    encrypted_text=encrypt_data(text, self.user_id),
+                    tokens=count_tokens(text),
+                )
+                for offset, (role, text) in enumerate(turns)
+            )
+            self.turn_count = index + len(turns)
+            self.save(update_fields=['turn_count', 'updated_at'])
+
+    def fold(self, summary, through):
+        """
+        Replaces the rolling summary with one that covers all turns before
+        index 'through'. Returns False, changing nothing, if another request
+        has folded turns since this conversation was loaded.
+        """
+        encrypted_summary = encrypt_data(summary, self.user_id)
+        updated = Conversation.objects.filter(
+            pk=self.pk, summarized_through=self.summarized_through
+        ).update(encrypted_summary=encrypted_summary, summarized_through=through)
+        if updated:
+            self.encrypted_summary = encrypted_summary
+            self.summarized_through = through
+        return bool(updated)
+
+
+class ChatTurn(models.Model):
+    """
+    One message of a Conversation, encrypted.
+    """
+    ROLE_CHOICES = [
+        ('user', 'User'),
+        ('assistant', 'Assistant'),
+    ]
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='turns')
+    index = models.PositiveIntegerField()
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    encrypted_text = models.TextField(blank=True, default='')
+    # Estimated size of the text in model tokens, so the history can be
+    # budgeted without decrypting it.
+    tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'index'], name='notes_chat_turn_unique_index'),
+        ]
+
+    def __str__(self):
+        return f"{self.conversation_id}#{self.index} ({self.role})"
+
+    @property
+    def text(self):
+        cached = getattr(self, '_decrypted_text', None)
+        if cached is None or cached[0] != self.encrypted_text:
+            cached = (self.encrypted_text, decrypt_data(self.encrypted_text))
+            self._decrypted_text = cached
+        return cached[1]
+
+    @classmethod
+    def decrypt_all(cls, turns, parallel=None):
+        """
+        Decrypts the text of a list of turns in one batched step.
+        """
+        return decrypt_attached(turns, lambda turn: turn.encrypted_text, '_decrypted_text', parallel)
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by `manage.py run_jobs` (see notes/jobs.py)
+    instead of inside a request. Payload and result are JSON, stored
+    encrypted: they hold prompts and replies.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    # Maintenance jobs have no user.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    encrypted_payload = models.TextField(blank=True, default='')
+    encrypted_result = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=1)
+    # Not claimed before this time (set when a failed attempt is retried)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, default='')
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest ready job.
+            models.Index(fields=['status', 'run_after'], name='notes_job_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @property
+    def payload(self):
+        return json.loads(decrypt_data(self.encrypted_payload) or '{}')
+
+    @property
+    def result(self):
+        result = decrypt_data(self.encrypted_result)
+        return json.loads(result) if result else None
+
+    @classmethod
+    def enqueue(cls, kind, payload=None, user=None, max_attempts=None):
+        """
+        Queues a job for the workers and returns it.
+        """
+        user_id = user.pk if user is not None else None
+        return cls.objects.create(
+            user=user,
+            kind=kind,
+            encrypted_payload=encrypt_data(json.dumps(payload or {}), user_id),
+            max_attempts=max_attempts or settings.JOB_QUEUE['max_attempts'],
+        )
+
+    @classmethod
+    def claim(cls, worker, pk=None):
+        """
+        Marks the oldest ready job (or job 'pk', if it is ready) as running
+        for 'worker' and returns it, or None if no job is ready. Concurrent
+        workers never claim the same job.
+        """
+        ready = cls.objects.filter(status=cls.QUEUED, run_after__lte=timezone.now()).order_by('run_after', 'pk')
+        if pk is not None:
+            ready = ready.filter(pk=pk)
+        claimed = {'status': cls.RUNNING, 'locked_by': worker, 'attempts': F('attempts') + 1}
+        if connection.features.has_select_for_update_skip_locked:
+            # PostgreSQL (and MySQL): lock the row, skipping rows other
+            # workers hold, so claims never wait for each other.
+            with transaction.atomic():
+                pk = ready.select_for_update(skip_locked=True).values_list('pk', flat=True).first()
+                if pk is None:
+                    return None
+                cls.objects.filter(pk=pk).update(locked_at=timezone.now(), **claimed)
+            return cls.objects.get(pk=pk)
+        # SQLite has no row locks: the UPDATE only succeeds for the worker
+        # that still finds the job queued; the others try the next one.
+        while True:
+            pk = ready.values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            if cls.objects.filter(pk=pk, status=cls.QUEUED).update(locked_at=timezone.now(), **claimed):
+                return cls.objects.get(pk=pk)
+
+    def _update_if_claimed(self, **fields):
+        # A job requeued as stale meanwhile belongs to another worker now.
+        return Job.objects.filter(pk=self.pk, status=Job.RUNNING, locked_by=self.locked_by).update(**fields)
+
+    def finish(self, result=None):
+        """
+        Records the (JSON-serializable) result of a successful run.
+        """
+        self._update_if_claimed(
+            status=Job.DONE,
+            encrypted_result=encrypt_data(json.dumps(result), self.user_id),
+            error='',
+            finished_at=timezone.now(),
+        )
+
+    def fail(self, error):
+        """
+        Records a failed run. The job is queued again after an exponentially
+        growing delay (with jitter, so failed jobs do not retry in step)
+        until it has used up its attempts.
+        """
+        error = str(error)[:1000]
+        if self.attempts < self.max_attempts:
+            options = settings.JOB_QUEUE
+            delay = min(options['retry_backoff'] * 2 ** (self.attempts - 1), options['max_backoff'])
+            delay *= random.uniform(0.5, 1.0)
+            self._update_if_claimed(
+                status=Job.QUEUED,
+                error=error,
+                locked_by='',
+                locked_at=None,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            self._update_if_claimed(status=Job.FAILED, error=error, finished_at=timezone.now())
+
+    @classmethod
+    def requeue_stale(cls, older_than):
+        """
+        Queues again the jobs claimed before 'older_than' that are still
+        running: their worker died. Returns how many there were.
+        """
+        stale = cls.objects.filter(status=cls.RUNNING, locked_at__lt=older_than)
+        failed = stale.filter(attempts__gte=F('max_attempts')).update(
+            status=cls.FAILED, error="The worker running this job stopped.", finished_at=timezone.now()
+        )
+        return failed + stale.update(status=cls.QUEUED, locked_by='', locked_at=None, run_after=timezone.now())
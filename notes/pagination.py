@@ -0,0 +1,123 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of COUNT(*) plus OFFSET, each page continues from the sort key of
+the last row of the previous one, so every page costs the same as the first
+and is served straight from the (user, ...) index. Cursors are signed,
+opaque tokens holding that sort key and the direction to move in.
+"""
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'notes.pagination'
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset ordered by 'ordering', e.g. ('-created_at', '-id').
+    The last field must be unique (normally the primary key) so that every
+    row has a distinct position.
+    """
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self.fields = [name.lstrip('-') for name in ordering]
+        self.descending = [name.startswith('-') for name in ordering]
+
+    def get_page(self, cursor=None):
+        """
+        Returns the page a cursor points to, or the first page if the cursor
+        is missing or invalid.
+        """
+        position, backwards = self._decode(cursor)
+        rows = list(self.page_queryset(position, backwards))
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or backwards:
+                next_cursor = self._encode(rows[-1], backwards=False)
+            if (has_more and backwards) or (position is not None and not backwards):
+                previous_cursor = self._encode(rows[0], backwards=True)
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+    def page_queryset(self, position=None, backwards=False):
+        """
+        Returns the query for the page after 'position' (a list of sort key
+        values), or before it when going backwards. One row more than a page
+        is fetched to tell whether there is another page.
+        """
+        queryset = self.queryset
+        ordering = self.ordering
+        if position is not None:
+            queryset = queryset.filter(self._after(position, backwards))
+        if backwards:
+            ordering = [self._flip(name) for name in ordering]
+        return queryset.order_by(*ordering)[:self.per_page + 1]
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else '-' + name
+
+    def _after(self, position, backwards):
+        """
+        Builds the filter for rows strictly after 'position' in the ordering
+        (before it when going backwards), i.e. a row-value comparison spelled
+        out as (a > x) OR (a = x AND b > y) ...
+        """
+        condition = Q()
+        for i in reversed(range(len(self.fields))):
+            lookup = 'lt' if self.descending[i] != backwards else 'gt'
+            strictly = Q(**{f'{self.fields[i]}__{lookup}': position[i]})
+            if i == len(self.fields) - 1:
+                condition = strictly
+            else:
+                condition = strictly | (Q(**{self.fields[i]: position[i]}) & condition)
+        # Repeat the bound on the leading field on its own (inclusive), so the
+        # database can seek to it in the index instead of filtering row by row.
+        leading = 'lte' if self.descending[0] != backwards else 'gte'
+        return Q(**{f'{self.fields[0]}__{leading}': position[0]}) & condition
+
+    def _encode(self, obj, backwards):
+        model = self.queryset.model
+        values = [
+            model._meta.get_field(name).value_to_string(obj) for name in self.fields
+        ]
+        return signing.dumps({'k': values, 'b': backwards}, salt=CURSOR_SALT, compress=True)
+
+    def _decode(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+            model = self.queryset.model
+            position = [
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.fields, data['k'], strict=True)
+            ]
+            return position, bool(data['b'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            return None, False
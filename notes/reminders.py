@@ -0,0 +1,152 @@
+"""
+Push delivery of task reminders over Server-Sent Events.
+
+One ReminderHub per process (per event loop) serves every connected tab.
+Its scheduler looks up due reminders for all connected users in a single
+query, then sleeps until the next task enters the reminder window, instead
+of every tab polling every 30 seconds. Saving or deleting a Task wakes the
+scheduler early (see notes/signals.py). Delivered reminders are recorded in
+the TaskReminder ledger, shared with the polling endpoint and across
+processes and devices.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Task, TaskReminder
+
+# Tasks due within this window trigger a reminder.
+REMINDER_WINDOW = timedelta(minutes=30)
+# Most reminders returned by one poll of the fallback endpoint.
+MAX_REMINDERS_PER_POLL = 20
+# Upper bound on how long the scheduler sleeps, so tasks created through
+# another worker process are still picked up.
+RESCAN_INTERVAL = 60  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+def pending_reminders(now, **filters):
+    """
+    Returns the tasks due within the reminder window whose reminder has not
+    been delivered yet (an anti-join against the TaskReminder ledger).
+    """
+    return Task.objects.filter(
+        due_date__gt=now,
+        due_date__lte=now + REMINDER_WINDOW,
+        reminder__isnull=True,
+        **filters
+    ).only('id', 'user_id', 'title', 'due_date').order_by('due_date')
+
+
+def reminder_payload(task):
+    """
+    Returns the JSON-ready description of a reminder sent to the browser.
+    """
+    local_due_date = task.due_date.astimezone(timezone.get_current_timezone())
+    return {
+        'id': task.pk,
+        'title': task.title,
+        'due_date_str': local_due_date.strftime("%#I:%M %p")
+    }
+
+
+class ReminderHub:
+    def __init__(self, loop):
+        self.loop = loop
+        self._subscribers = defaultdict(set)  # user id -> set of asyncio.Queue
+        self._wakeup = asyncio.Event()
+        self._scheduler = None
+
+    def subscribe(self, user_id):
+        """
+        Registers a connected client and returns the queue its reminders
+        (lists of payloads) are put on.
+        """
+        queue = asyncio.Queue()
+        self._subscribers[user_id].add(queue)
+        if self._scheduler is None or self._scheduler.done():
+            self._scheduler = self.loop.create_task(self._run())
+        self._wakeup.set()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def wake(self):
+        """
+        Makes the scheduler re-check now. Safe to call from any thread.
+        """
+        self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while self._subscribers:
+            self._wakeup.clear()
+            try:
+                timeout = await self._check()
+            except Exception:
+                logger.exception("Reminder check failed")
+                timeout = RESCAN_INTERVAL
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self):
+        """
+        Pushes the reminders that are due and returns how many seconds to
+        sleep until the next one.
+        """
+        now = timezone.now()
+        user_ids = list(self._subscribers)
+
+        due_tasks = [
+            task async for task in pending_reminders(now, user_id__in=user_ids)
+        ]
+        if due_tasks:
+            await sync_to_async(TaskReminder.record)(due_tasks)
+            for task in due_tasks:
+                for queue in self._subscribers.get(task.user_id, ()):
+                    queue.put_nowait([reminder_payload(task)])
+        await sync_to_async(TaskReminder.prune)(now)
+
+        # Sleep until the next task enters the reminder window.
+        next_due = (await Task.objects.filter(
+            user_id__in=user_ids,
+            due_date__gt=now + REMINDER_WINDOW
+        ).aaggregate(next_due=Min('due_date')))['next_due']
+        if next_due is None:
+            return RESCAN_INTERVAL
+        seconds = (next_due - REMINDER_WINDOW - timezone.now()).total_seconds()
+        return min(max(seconds, 0), RESCAN_INTERVAL)
+
+
+_hub = None
+
+
+def get_hub():
+    """
+    Returns the hub for the running event loop (creating it if needed).
+    """
+    global _hub
+    loop = asyncio.get_running_loop()
+    if _hub is None or _hub.loop is not loop:
+        _hub = ReminderHub(loop)
+    return _hub
+
+
+def wake_hub():
+    """
+    Wakes the hub, if there is one, because tasks have changed.
+    """
+    if _hub is not None and not _hub.loop.is_closed():
+        _hub.wake()
@@ -0,0 +1,30 @@
+import hashlib
+
+import markdown
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
+
+# Number of words shown on a note card in the notes board.
+PREVIEW_WORDS = 15
+
+
+def render_markdown(text):
+    """
+    Converts Markdown text to HTML (the same way the 'markdownify' filter does).
+    """
+    return markdown.markdown(text or '', extensions=['fenced_code'])
+
+
+def make_preview(html):
+    """
+    Returns the plain-text card preview for a rendered note.
+    """
+    return Truncator(strip_tags(html)).words(PREVIEW_WORDS)
+
+
+def content_hash(encrypted_content):
+    """
+    Returns the cache key for a note's rendered output. It hashes the stored
+    ciphertext, so checking whether a render is stale needs no decryption.
+    """
+    return hashlib.sha256((encrypted_content or '').encode('utf-8')).hexdigest()
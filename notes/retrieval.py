@@ -0,0 +1,159 @@
+"""
+Local retrieval for the AI chat: notes are split into overlapping passages,
+and each passage gets a vector from a feature-hashing model (no training, no
+network). A chat prompt is embedded the same way and the passages most
+similar to it (cosine similarity) are sent to the model as context instead
+of whole notes.
+
+The vectors and passages are stored encrypted in NoteEmbedding, like every
+other piece of note content; this module only does the arithmetic.
+"""
+import base64
+import functools
+import hashlib
+import math
+import re
+
+import numpy as np
+
+from .search import WORD_RE
+
+# Bump when chunking or embedding changes; rows of other versions are
+# ignored until `manage.py rebuild_search_index` re-embeds them.
+EMBEDDING_VERSION = 1
+DIMENSIONS = 4096
+# Passage length and overlap, in words.
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+
+# Frequent words that say nothing about what a passage is about.
+STOP_WORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has
+have having he her here hers herself him himself his how i if in into is it its itself just me
+more most my myself no nor not now of off on once only or other our ours ourselves out over own
+same she should so some such than that the their theirs them themselves then there these they
+this those through to too under until up very was we were what when where which while who whom
+why will with would you your yours yourself yourselves
+""".split())
+
+_SPAN_RE = re.compile(r"\S+")
+
+
+def chunk_text(text):
+    """
+    Splits text into passages of CHUNK_WORDS words, each overlapping the
+    previous one by CHUNK_OVERLAP words. Passages are cut from the original
+    text, so line breaks (lists, code) survive.
+    """
+    spans = [match.span() for match in _SPAN_RE.finditer(text or '')]
+    if not spans:
+        return []
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    chunks = []
+    for first in range(0, len(spans), step):
+        last = min(first + CHUNK_WORDS, len(spans)) - 1
+        chunks.append(text[spans[first][0]:spans[last][1]])
+        if last == len(spans) - 1:
+            break
+    return chunks
+
+
+def _terms(text):
+    words = [word for word in WORD_RE.findall((text or '').casefold()) if word not in STOP_WORDS]
+    # Word pairs catch some phrasing ("machine learning") that single words miss.
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+@functools.lru_cache(maxsize=65536)
+def _feature(term):
+    """
+    Returns (column, sign) of a term. Hashing with a random sign keeps
+    collisions from adding up to false similarity.
+    """
+    value = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'big')
+    return value % DIMENSIONS, 1.0 if value >> 63 else -1.0
+
+
+def embed(texts):
+    """
+    Returns a (len(texts), DIMENSIONS) float32 matrix of unit-length rows
+    (all zeros for a text without any terms).
+    """
+    matrix = np.zeros((len(texts), DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = {}
+        for term in _terms(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            column, sign = _feature(term)
+            # Sublinear term frequency: a word repeated ten times is not ten
+            # times as important.
+            matrix[row, column] += sign * (1.0 + math.log(count))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def encode_vectors(matrix):
+    """
+    Serializes a matrix of passage vectors as text (float16, base64), the
+    form crypt.encrypt_data() takes.
+    """
+    return base64.b64encode(np.asarray(matrix, dtype='<f2').tobytes()).decode('ascii')
+
+
+def decode_vectors(text):
+    """
+    Reverses encode_vectors(). Raises ValueError if 'text' is not a matrix.
+    """
+    data = base64.b64decode(text.encode('ascii'), validate=True)
+    if len(data) % (2 * DIMENSIONS):
+        raise ValueError("Not a matrix of passage vectors")
+    return np.frombuffer(data, dtype='<f2').reshape(-1, DIMENSIONS)
+
+
+class PassageRanker:
+    """
+    Keeps the k passages most similar to a query vector across batches of
+    notes. Each passage is identified by (note id, passage index).
+    """
+    # Note id and passage index are packed into one integer per passage.
+    _INDEX_BITS = 20
+
+    def __init__(self, query_vector, k):
+        self.query_vector = query_vector
+        self.k = k
+        self.scores = np.empty(0, dtype=np.float32)
+        self.keys = np.empty(0, dtype=np.int64)
+
+    def add(self, matrices):
+        """
+        Scores a batch of {note id: passage vector matrix} with one matrix
+        product, keeping the best k passages seen so far.
+        """
+        matrices = {note_id: matrix for note_id, matrix in matrices.items() if len(matrix)}
+        if not matrices:
+            return
+        scores = np.vstack(list(matrices.values())).astype(np.float32) @ self.query_vector
+        keys = np.concatenate([
+            (note_id << self._INDEX_BITS) + np.arange(len(matrix), dtype=np.int64)
+            for note_id, matrix in matrices.items()
+        ])
+        scores = np.concatenate([self.scores, scores])
+        keys = np.concatenate([self.keys, keys])
+        if len(scores) > self.k:
+            keep = np.argpartition(scores, -self.k)[-self.k:]
+            scores, keys = scores[keep], keys[keep]
+        self.scores, self.keys = scores, keys
+
+    def results(self, min_score=0.0):
+        """
+        Returns [(note id, passage index, score), ...], best first.
+        """
+        mask = (1 << self._INDEX_BITS) - 1
+        return [
+            (int(self.keys[i]) >> self._INDEX_BITS, int(self.keys[i]) & mask, float(self.scores[i]))
+            for i in np.argsort(-self.scores, kind='stable')
+            if self.scores[i] >= min_score
+        ]
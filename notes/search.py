@@ -0,0 +1,44 @@
+import re
+
+from .crypt import blind_index
+
+# Words are indexed by every prefix between these lengths, so the live search
+# box (which fires from 3 characters) can match a word while it is being typed.
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_LENGTH = 20
+
+WORD_RE = re.compile(r"\w+")
+
+
+def _words(text):
+    return WORD_RE.findall((text or '').casefold())
+
+
+def index_terms(text):
+    """
+    Returns the set of plaintext terms a note is indexed under: every prefix of
+    every word, from MIN_PREFIX_LENGTH up to MAX_PREFIX_LENGTH characters.
+    Shorter words are indexed as a whole.
+    """
+    terms = set()
+    for word in _words(text):
+        start = min(len(word), MIN_PREFIX_LENGTH)
+        stop = min(len(word), MAX_PREFIX_LENGTH)
+        for length in range(start, stop + 1):
+            terms.add(word[:length])
+    return terms
+
+
+def note_tokens(user_id, text):
+    """
+    Returns the blind-index tokens to store for a note's text.
+    """
+    return {blind_index(user_id, term) for term in index_terms(text)}
+
+
+def query_tokens(user_id, query):
+    """
+    Returns the blind-index tokens a note must contain to match a search query.
+    Every word of the query has to match (AND semantics).
+    """
+    return {blind_index(user_id, word[:MAX_PREFIX_LENGTH]) for word in _words(query)}
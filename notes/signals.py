@@ -0,0 +1,44 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_user_cache_version
+from .crypt import forget_user_key
+from .models import Attachment, Blob, Note, Task, UserKey
+from .reminders import wake_hub
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def task_changed(sender, instance, **kwargs):
+    # A new or moved due date may need a reminder sooner than planned.
+    wake_hub()
+
+
+@receiver(post_save, sender=Note)
+@receiver(post_delete, sender=Note)
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+def user_data_changed(sender, instance, **kwargs):
+    # The user's cached pages are out of date. A save that changed nothing
+    # writes nothing and sends no post_save (see Note.save).
+    bump_user_cache_version(instance.user_id)
+
+
+@receiver(post_delete, sender=UserKey)
+def user_key_deleted(sender, instance, **kwargs):
+    # Also runs when the key goes with its user (cascade).
+    forget_user_key(instance.user_id)
+
+
+@receiver(post_delete, sender=Attachment)
+def attachment_deleted(sender, instance, **kwargs):
+    # Also runs when the attachment goes with its note, or is replaced.
+    Blob.release(instance.blob_id)
+
+
+@receiver(post_delete, sender=Blob)
+def blob_deleted(sender, instance, **kwargs):
+    # Files are only removed once the deletion is committed; a rollback
+    # must leave the blob readable.
+    transaction.on_commit(lambda: instance.get_backend().delete(instance))
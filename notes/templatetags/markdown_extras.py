@@ -1,6 +1,6 @@
 from django import template
 from django.utils.safestring import mark_safe
-import markdown
+from notes.rendering import render_markdown
 
 register = template.Library()
 
@@ -9,4 +9,4 @@ def markdownify(value):
     """
     Converts Markdown text to HTML.
     """
-    return mark_safe(markdown.markdown(value, extensions=['fenced_code']))
\ No newline at end of file
+    return mark_safe(render_markdown(value))
\ No newline at end of file
@@ -1,3 +1,280 @@
+import json
+import os
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import crypt, jobs
+from .models import Blob, Job, Note
+from .pagination import KeysetPaginator
+from .search import query_tokens
+
+PAYLOAD = os.urandom(150_000)  # three attachment chunks
+
+
+def make_note(user, title='Note', content='', file=None):
+    note = Note(user=user, title=title)
+    note.content = content
+    if file is not None:
+        note.set_attachment(file)
+    note.save()
+    return note
+
+
+def sleep_job(job):
+    return {'n': job.payload['n']}
+
+
+def failing_job(job):
+    raise RuntimeError('downstream unavailable')
+
+
+# --- Search ---
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.other = User.objects.create_user('bob', password='pw')
+        self.client.force_login(self.user)
+
+    def search(self, query):
+        response = self.client.get(reverse('notes:search_notes'), {'q': query})
+        return [note['title'] for note in response.json()['notes']]
+
+    def test_hit_and_miss(self):
+        make_note(self.user, 'Groceries', 'Buy pineapples and bread')
+        make_note(self.other, 'Bob', 'pineapples too')
+        self.assertEqual(self.search('pineapple'), ['Groceries'])  # a prefix
+        self.assertEqual(self.search('groceries'), ['Groceries'])  # the title
+        self.assertEqual(self.search('pineapples bread'), ['Groceries'])
+        self.assertEqual(self.search('pineapples cheese'), [])
+        self.assertEqual(self.search('mango'), [])
+
+    def test_tokens_are_per_user(self):
+        self.assertNotEqual(query_tokens(self.user.pk, 'word'), query_tokens(self.other.pk, 'word'))
+
+    def test_edit_updates_index(self):
+        note = make_note(self.user, 'Plans', 'visit the museum')
+        note.content = 'visit the beach'
+        note.save()
+        self.assertEqual(self.search('beach'), ['Plans'])
+        self.assertEqual(self.search('museum'), [])
+
+
+# --- Encryption ---
+class DecryptManyTests(TestCase):
+    def test_matches_decrypt_data(self):
+        user = User.objects.create_user('alice', password='pw')
+        long_text = 'compressible ' * 200
+        tokens = [
+            crypt.encrypt_data('user text', user.pk),
+            crypt.encrypt_data(long_text, user.pk),
+            crypt.encrypt_data('keyring text'),
+            '',
+            'not a token',
+            crypt.encrypt_data('user text', user.pk)[:-4] + 'AAAA',
+        ]
+        expected = [crypt.decrypt_data(token) for token in tokens]
+        self.assertEqual(expected[:4], ['user text', long_text, 'keyring text', ''])
+        self.assertEqual(crypt.decrypt_many(tokens, parallel=False), expected)
+        self.assertEqual(crypt.decrypt_many(tokens * 20, parallel=True), expected * 20)
+
+
+# --- Attachments ---
+class BlobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def blob(self):
+        note = make_note(self.user, file=SimpleUploadedFile('notes.txt', PAYLOAD))
+        return Blob.objects.get(pk=note.attachment.blob_id)
+
+    def rewrite_as(self, blob, key_id, storage_version):
+        """
+        Stores the blob's chunks the way older versions did.
+        """
+        def transform(index, data):
+            last = index == blob.chunk_count - 1
+            plaintext = crypt.unpack_envelope(crypt.decrypt_chunk(blob.nonce, index, data, last, blob.key_id))
+            if storage_version >= 2:
+                plaintext = crypt.pack_envelope(plaintext)
+            return crypt.encrypt_chunk(blob.nonce, index, plaintext, last, key_id)
+
+        blob.location = blob.get_backend().rewrite(blob, transform)
+        blob.key_id, blob.storage_version = key_id, storage_version
+        blob.save()
+
+    def test_repack_round_trip_with_new_nonce(self):
+        blob = self.blob()
+        self.rewrite_as(blob, blob.key_id, storage_version=1)
+        old_nonce = bytes(blob.nonce)
+        self.assertEqual(b''.join(blob.iter_bytes()), PAYLOAD)
+
+        self.assertTrue(blob.repack())
+        blob = Blob.objects.get(pk=blob.pk)
+        self.assertEqual(blob.storage_version, Blob.STORAGE_VERSION)
+        self.assertNotEqual(bytes(blob.nonce), old_nonce)
+        self.assertEqual(b''.join(blob.iter_bytes()), PAYLOAD)
+        self.assertFalse(blob.repack())
+
+    def test_rotate_key_round_trip(self):
+        blob = self.blob()
+        user_key_id = blob.key_id
+        self.rewrite_as(blob, crypt.PRIMARY_KEY_ID, storage_version=2)
+
+        self.assertEqual(blob.rotate_key(), blob.chunk_count)
+        blob = Blob.objects.get(pk=blob.pk)
+        self.assertEqual(blob.key_id, user_key_id)
+        self.assertEqual(b''.join(blob.iter_bytes()), PAYLOAD)
+        self.assertEqual(blob.rotate_key(), 0)
+
+
+class AttachmentRangeTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('alice', password='pw')
+        self.client.force_login(user)
+        note = make_note(user, file=SimpleUploadedFile('notes.txt', PAYLOAD))
+        self.url = reverse('notes:serve_attachment', args=[note.pk])
+
+    def get(self, byte_range):
+        return self.client.get(self.url, HTTP_RANGE=byte_range)
+
+    def test_partial_content(self):
+        # Across a chunk boundary, open-ended, and a suffix.
+        for byte_range, expected in [
+            ('bytes=65530-65545', PAYLOAD[65530:65546]),
+            ('bytes=149990-', PAYLOAD[149990:]),
+            ('bytes=-10', PAYLOAD[-10:]),
+        ]:
+            response = self.get(byte_range)
+            self.assertEqual(response.status_code, 206, byte_range)
+            self.assertEqual(b''.join(response.streaming_content), expected, byte_range)
+            self.assertEqual(response['Content-Length'], str(len(expected)))
+        self.assertEqual(self.get('bytes=0-9')['Content-Range'], f'bytes 0-9/{len(PAYLOAD)}')
+
+    def test_unsatisfiable_range(self):
+        response = self.get(f'bytes={len(PAYLOAD)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(PAYLOAD)}')
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), PAYLOAD)
+
+
+# --- Autosave ---
+class AutosaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='pw')
+        self.client.force_login(self.user)
+        self.note = make_note(self.user, 'Draft', 'first')
+        self.url = reverse('notes:autosave', args=[self.note.pk])
+        # Left over from an earlier run, the last-write time would hold back the first save.
+        caches['shared'].delete(f'notes:autosave-written:{self.note.pk}')
+
+    def autosave(self, **data):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json')
+
+    def test_save_draft_compare_and_swap(self):
+        self.assertTrue(self.note.save_draft(0, content='second'))
+        stale = Note.objects.get(pk=self.note.pk)
+        stale.revision = 0
+        self.assertFalse(stale.save_draft(0, content='lost'))
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, 'second')
+
+    def test_stale_revision_is_409(self):
+        self.assertEqual(self.autosave(revision=0, content='second', flush=True).status_code, 200)
+        response = self.autosave(revision=0, content='lost', flush=True)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['revision'], 1)
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, 'second')
+
+    def test_rapid_saves_are_held_back(self):
+        self.assertEqual(self.autosave(revision=0, content='a').status_code, 200)
+        response = self.autosave(revision=1, content='ab')
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.json()['saved'])
+        self.assertEqual(Note.objects.get(pk=self.note.pk).content, 'a')
+
+
+# --- Pagination ---
+class KeysetPaginatorTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('alice', password='pw')
+        start = timezone.now()
+        for number in range(5):
+            make_note(user, f'Note {number}')
+        # Two notes share a timestamp, so the id has to break the tie.
+        for number, note in enumerate(Note.objects.order_by('pk')):
+            Note.objects.filter(pk=note.pk).update(created_at=start + timedelta(minutes=min(number, 3)))
+        self.paginator = KeysetPaginator(Note.objects.all(), ('-created_at', '-id'), per_page=2)
+
+    def titles(self, page):
+        return [note.title for note in page]
+
+    def test_next_and_previous_pages(self):
+        first = self.paginator.get_page()
+        self.assertEqual(self.titles(first), ['Note 4', 'Note 3'])
+        self.assertFalse(first.has_previous())
+
+        second = self.paginator.get_page(first.next_cursor)
+        self.assertEqual(self.titles(second), ['Note 2', 'Note 1'])
+        third = self.paginator.get_page(second.next_cursor)
+        self.assertEqual(self.titles(third), ['Note 0'])
+        self.assertFalse(third.has_next())
+
+        back = self.paginator.get_page(third.previous_cursor)
+        self.assertEqual(self.titles(back), ['Note 2', 'Note 1'])
+        self.assertEqual(self.titles(self.paginator.get_page(back.previous_cursor)), ['Note 4', 'Note 3'])
+
+    def test_invalid_cursor_gives_first_page(self):
+        self.assertEqual(self.titles(self.paginator.get_page('tampered')), ['Note 4', 'Note 3'])
+
+
+# --- Jobs ---
+@mock.patch.dict(jobs.HANDLERS, {'sleep': 'notes.tests.sleep_job', 'failing': 'notes.tests.failing_job'})
+class JobTests(TestCase):
+    def setUp(self):
+        jobs.get_handler.cache_clear()
+
+    def tearDown(self):
+        jobs.get_handler.cache_clear()
+
+    def test_claim_is_exclusive(self):
+        first = Job.enqueue('sleep', {'n': 1})
+        second = Job.enqueue('sleep', {'n': 2})
+        claimed = [Job.claim('worker-a'), Job.claim('worker-b')]
+        self.assertEqual({job.pk for job in claimed}, {first.pk, second.pk})
+        self.assertEqual({job.locked_by for job in claimed}, {'worker-a', 'worker-b'})
+        self.assertIsNone(Job.claim('worker-c'))
+
+        jobs.run_job(claimed[0])
+        self.assertEqual(Job.objects.get(pk=claimed[0].pk).result, {'n': claimed[0].payload['n']})
+
+    def test_retry_backoff(self):
+        job = Job.enqueue('failing', max_attempts=3)
+        delays = []
+        for attempt in (1, 2):
+            before = timezone.now()
+            with self.assertLogs('notes.jobs', 'ERROR'):
+                jobs.run_job(Job.claim('worker'))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), (Job.QUEUED, attempt))
+            self.assertIn('downstream unavailable', job.error)
+            self.assertIsNone(Job.claim('worker'))  # not ready until run_after
+            delays.append((job.run_after - before).total_seconds())
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
 
-# Create your tests here.
+        # Base delay, then twice that; each cut by up to half for jitter.
+        self.assertTrue(5 <= delays[0] <= 10.5, delays)
+        self.assertTrue(10 <= delays[1] <= 20.5, delays)
+        with self.assertLogs('notes.jobs', 'ERROR'):
+            jobs.run_job(Job.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
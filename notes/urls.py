@@ -9,6 +9,7 @@ urlpatterns = [
     path('', views.home, name='dashboard'),
 
     path('notes/', views.note, name='note'),
+    path('notes/feed/', views.note_feed, name='note_feed'),
     path('files/', views.files, name='files'),
     path('search/', views.search_notes, name='search_notes'),
 
@@ -22,6 +23,7 @@ urlpatterns = [
     path('note/create/', views.note_create, name='create'),
     path('note/<int:pk>/', views.note_detail, name='detail'),
     path('note/<int:pk>/edit/', views.note_update, name='edit'),
+    path('note/<int:pk>/autosave/', views.note_autosave, name='autosave'),
     path('note/<int:pk>/delete/', views.note_delete, name='delete'),
     
     path('note/<int:pk>/attachment/', views.serve_attachment, name='serve_attachment'),
@@ -29,8 +31,10 @@ urlpatterns = [
     # Task CRUD
     path('calendar/', views.calendar_view, name='calendar'),
     path('calendar/<int:year>/<int:month>/', views.calendar_view, name='calendar_month'),
+    path('calendar/<int:year>/<int:month>/summary/', views.calendar_summary, name='calendar_summary'),
     path('calendar/<int:year>/<int:month>/<int:day>/', views.calendar_day_view, name='calendar_day'),
     path('task/', views.task, name='task'),
+    path('task/feed/', views.task_feed, name='task_feed'),
     path('task/create/', views.task_create, name='task_create'),
     
     # --- REMOVED the subtask_create URL ---
@@ -38,8 +42,13 @@ urlpatterns = [
     path('task/<int:pk>/edit/', views.task_update, name='task_edit'),
     path('task/<int:pk>/delete/', views.task_delete, name='task_delete'),
     path('task-notifications/', views.check_task_notifications, name='task_notifications'),
+    path('task-notifications/stream/', views.task_notification_stream, name='task_notification_stream'),
 
     #AI Chat Integration
     path('chat/', views.chat_view, name='chat'),
-    path('save_chat/', views.save_chat_note, name='save_chat')
+    path('chat/stream/', views.chat_stream, name='chat_stream'),
+    path('save_chat/', views.save_chat_note, name='save_chat'),
+
+    # Background jobs
+    path('jobs/<int:pk>/', views.job_status, name='job_status'),
 ]
\ No newline at end of file
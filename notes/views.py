@@ -1,6 +1,12 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.core.paginator import Paginator
-from .models import Note, Task
+from .models import Attachment, Conversation, Job, Note, NoteEmbedding, NoteSearchToken, Task, TaskReminder
+from .search import query_tokens
+from .blobstore import BlobNotFound
+from .caching import user_cache_version
+from .pagination import KeysetPaginator
+from .rendering import content_hash, render_markdown
+from . import jobs, llm
+from .reminders import MAX_REMINDERS_PER_POLL, get_hub, pending_reminders, reminder_payload
 from .forms import NoteForm , TimeScheduleForm
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
@@ -8,15 +14,23 @@ from django.contrib import messages
 from datetime import datetime , date, timedelta
 from django.utils import timezone
 from calendar import monthrange
-from django.db.models import Q  
+from django.db.models import Q, Count
+import hashlib
 import json
-from django.http import JsonResponse, HttpResponse, Http404
+import time
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.conf import settings
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.middleware.csrf import get_token
 from django.urls import reverse
-import google.generativeai as genai
-import mimetypes # To guess the file type
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date, quote_etag
+from asgiref.sync import sync_to_async
 import calendar
-import markdown # <-- IMPORT ADDED
+import asyncio
+from cryptography.fernet import InvalidToken
 
 
 @login_required
@@ -24,11 +38,21 @@ def search_notes(request):
     query = request.GET.get('q', '')
     notes = []
     if query and len(query) > 2:
+        # Look the query up in the blind index instead of scanning the
+        # (encrypted) notes: a note matches when it has a posting for
+        # every word of the query.
+        tokens = query_tokens(request.user.pk, query)
+        matching_ids = NoteSearchToken.objects.filter(
+            user=request.user,
+            token__in=tokens
+        ).values('note').annotate(
+            hits=Count('token')
+        ).filter(hits=len(tokens)).values('note')
+
         note_results = Note.objects.filter(
-            user=request.user
-        ).filter(
-            Q(title__icontains=query) | Q(encrypted_content__icontains=query)
-        ).order_by('-created_at')[:10]
+            user=request.user,
+            pk__in=matching_ids
+        ).only('id', 'title').order_by('-created_at')[:10]
         
         for note in note_results:
             notes.append({
@@ -40,18 +64,26 @@ def search_notes(request):
     return JsonResponse({'notes': notes})
 
 
+# The dashboard, notes board and calendar cache their rendered content per
+# user, keyed by the user's cache version (see notes/caching.py). Their data
+# is passed to the template lazily, so a cached fragment costs no queries.
+
 @login_required
 def home(request):
-    recent_notes = Note.objects.filter(user=request.user).order_by('-created_at')[:5]
+    recent_notes = Note.objects.filter(user=request.user).select_related('ai_summary').only(
+        'id', 'user_id', 'title', 'created_at', 'revision', 'ai_summary__revision', 'ai_summary__encrypted_summary'
+    ).order_by('-created_at')[:5]
     upcoming_tasks = Task.objects.filter(
         user=request.user, 
         due_date__gte=timezone.now()
     ).order_by('due_date')[:5]
 
     context = {
-        'total_notes': Note.objects.filter(user=request.user).count(),
-        'recent_notes': recent_notes,
+        'total_notes': Note.objects.filter(user=request.user).count,
+        # Summaries precomputed by `manage.py summarize_notes`; no model calls here.
+        'recent_notes': SimpleLazyObject(lambda: Note.decrypt_page(recent_notes, ['summary'])),
         'upcoming_tasks': upcoming_tasks,
+        'cache_version': user_cache_version(request.user.pk),
         'year': datetime.now().year,
     }
     return render(request, 'notes/dashboard.html', context)
@@ -60,10 +92,10 @@ def home(request):
 @login_required
 def note_create(request):
     if request.method == 'POST':
-        form = NoteForm(request.POST, request.FILES)
+        # The owner is set up front: the content is encrypted with their key.
+        form = NoteForm(request.POST, request.FILES, instance=Note(user=request.user))
         if form.is_valid():
             note = form.save(commit=False)
-            note.user = request.user
             note.save() 
             messages.success(request, f"Note '{note.title}' created successfully!")
             return redirect('notes:note')
@@ -89,6 +121,56 @@ def note_update(request, pk):
         form = NoteForm(instance=note)
     return render(request, 'notes/note_form.html', {'form': form, 'note': note})
 
+# --- Autosave ---
+# Drafts arriving faster than this are turned away; the editor resends them.
+AUTOSAVE_INTERVAL = 5  # seconds
+
+
+@login_required
+def note_autosave(request, pk):
+    """
+    Autosaves the note editor. Takes JSON {"revision", "title"?, "content"?}
+    holding the fields changed since the last successful save, where
+    'revision' is the note revision the edits are based on.
+
+    The fields sent are written as they are, at most once per AUTOSAVE_INTERVAL
+    (or at once with "flush": true); a draft arriving sooner is not kept, and
+    the editor sends its changes again after 'retry_after'. Responses:
+    200 {"saved": true, "revision"} when written, 202 {"saved": false,
+    "retry_after"} when held back, 409 {"revision"} when the note was saved
+    elsewhere since 'revision'.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method.'}, status=405)
+    try:
+        data = json.loads(request.body)
+        revision = int(data['revision'])
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+    fields = {name: data[name] for name in ('title', 'content') if isinstance(data.get(name), str)}
+    if 'title' in fields and not 0 < len(fields['title']) <= Note._meta.get_field('title').max_length:
+        return JsonResponse({'error': 'Invalid title.'}, status=400)
+
+    note = get_object_or_404(Note.objects.only('id', 'user_id', 'title', 'revision'), pk=pk, user=request.user)
+    if note.revision != revision:
+        return JsonResponse({'error': 'The note was changed elsewhere.', 'revision': note.revision}, status=409)
+
+    # When the note was last autosaved, in the cache every process sees.
+    written = caches['shared']
+    written_key = f'notes:autosave-written:{pk}'
+    written_at = written.get(written_key)
+    if not data.get('flush') and written_at is not None and time.time() - written_at < AUTOSAVE_INTERVAL:
+        retry_after = AUTOSAVE_INTERVAL - (time.time() - written_at)
+        return JsonResponse({'saved': False, 'revision': revision, 'retry_after': max(retry_after, 0)}, status=202)
+
+    if not fields:
+        return JsonResponse({'saved': True, 'revision': revision})
+    if not note.save_draft(revision, **fields):
+        return JsonResponse({'error': 'The note was changed elsewhere.'}, status=409)
+    # Only a save that happened holds back the next one.
+    written.set(written_key, time.time(), AUTOSAVE_INTERVAL)
+    return JsonResponse({'saved': True, 'revision': note.revision})
+
 @login_required
 def note_delete(request, pk):
     note = get_object_or_404(Note, pk=pk, user=request.user) 
@@ -100,8 +182,23 @@ def note_delete(request, pk):
 
 @login_required 
 def note_detail(request, pk):
-    note = get_object_or_404(Note, pk=pk, user=request.user) 
-    return render(request, 'notes/note_detail.html', {'note': note})
+    note = get_object_or_404(Note.objects.select_related('attachment', 'render'), pk=pk, user=request.user)
+    # Validated from stored values only: a repeat visit gets a 304 without
+    # decrypting or rendering anything. The CSRF secret is part of the ETag
+    # because the page embeds a token derived from it (the logout form);
+    # get_token() creates it now if this is the client's first visit.
+    get_token(request)
+    etag = _etag(
+        content_hash(note.encrypted_content), note.title, note.attachment_name, note.updated_at,
+        request.META['CSRF_COOKIE'],
+    )
+    # Pending flash messages have to be rendered, so never answer 304 then.
+    if not len(messages.get_messages(request)):
+        response = _conditional_response(request, etag, note.updated_at)
+        if response is not None:
+            return response
+    response = render(request, 'notes/note_detail.html', {'note': note})
+    return _set_validators(response, etag, note.updated_at)
 
 def register(request):
     if request.method == 'POST':
@@ -122,47 +219,288 @@ def dashboard(request):
     return render(request, 'notes/dashboard.html', context)
 
 
-@login_required
-def note(request):
+# --- Keyset pagination ---
+NOTES_PER_PAGE = 10
+TASKS_PER_PAGE = 50
+
+
+def _note_page(request):
     q = request.GET.get('q', '')
-    notes = Note.objects.filter(user=request.user)
+    # Attachment metadata only; the encrypted file contents are never loaded.
+    notes = Note.objects.filter(user=request.user).select_related('attachment', 'render', 'ai_summary')
     if q:
         notes = notes.filter(Q(title__icontains=q))
-    paginator = Paginator(notes.order_by('-created_at'), 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = KeysetPaginator(notes, ('-created_at', '-id'), NOTES_PER_PAGE)
+    page = paginator.get_page(request.GET.get('cursor'))
+    # Decrypt all card previews (and AI summaries) in one batch rather than
+    # one per template lookup.
+    Note.decrypt_page(page.object_list, ['preview', 'summary'])
+    return page, q
+
+
+def _task_page(request):
+    tasks = Task.objects.filter(user=request.user)
+    paginator = KeysetPaginator(tasks, ('due_date', 'id'), TASKS_PER_PAGE)
+    return paginator.get_page(request.GET.get('cursor'))
+
+
+def _feed_response(page, items):
+    return JsonResponse({
+        'items': items,
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+@login_required
+def note(request):
     context = {
-        'page_obj': page_obj,
-        'q': q,
+        'page_obj': SimpleLazyObject(lambda: _note_page(request)[0]),
+        'q': request.GET.get('q', ''),
+        'cursor': request.GET.get('cursor', ''),
+        'cache_version': user_cache_version(request.user.pk),
         'year': datetime.now().year,
     }
     return render(request, 'notes/note.html', context)
 
+
+@login_required
+def note_feed(request):
+    """
+    JSON pages of the notes board for infinite scrolling. Pass the 'next'
+    token back as ?cursor= to get the following page.
+    """
+    page, _ = _note_page(request)
+    return _feed_response(page, [
+        {
+            'id': n.pk,
+            'title': n.title,
+            'preview': n.preview,
+            'summary': n.ai_summary_text,
+            'created_at': n.created_at.isoformat(),
+            'has_attachment': n.attachment_name is not None,
+            'url': reverse('notes:detail', args=[n.pk]),
+            'edit_url': reverse('notes:edit', args=[n.pk]),
+            'delete_url': reverse('notes:delete', args=[n.pk]),
+        }
+        for n in page
+    ])
+
 @login_required
 def files(request):
-    notes_with_files = Note.objects.filter(user=request.user).exclude(attachment_name__isnull=True).exclude(attachment_name__exact='')
+    notes_with_files = Note.objects.filter(
+        user=request.user,
+        attachment__isnull=False
+    ).select_related('attachment')
     context = {
         'notes_with_files': notes_with_files,
     }
     return render(request, 'notes/files.html', context)
 
 
+def _parse_byte_range(range_header, size):
+    """
+    Parses a single-range 'Range: bytes=...' header into (start, end).
+    Returns None when the header is missing or not something we handle (the
+    whole file is then sent), and raises ValueError when the range cannot be
+    satisfied.
+    """
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_str, _, end_str = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start = max(size - int(end_str), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("Unsatisfiable range")
+    return start, min(end, size - 1)
+
+
+# --- Conditional GET ---
+
+def _etag(*parts):
+    """
+    Returns a strong ETag (quoted) for a response determined by 'parts'.
+    """
+    digest = hashlib.sha256('\0'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return quote_etag(digest[:32])
+
+
+def _conditional_response(request, etag, last_modified):
+    """
+    Returns a 304 Not Modified (or 412) response when the client's cached
+    copy is still current according to If-None-Match / If-Modified-Since,
+    or None when the full response has to be built.
+    """
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp())
+    )
+    if response is not None:
+        _set_validators(response, etag, last_modified)
+    return response
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Each user's own data: the browser may keep it but must revalidate before
+    # every reuse (a cheap 304 when unchanged); shared caches must not store it.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _streaming_content(request, iterator):
+    """
+    Under ASGI, Django would buffer a plain iterator into a list before
+    sending it. Hand it an async iterator instead, which pulls one piece at
+    a time from the sync one.
+    """
+    if not isinstance(request, ASGIRequest):
+        return iterator
+
+    async def pieces():
+        while (piece := await sync_to_async(next)(iterator, None)) is not None:
+            yield piece
+
+    return pieces()
+
+
 @login_required
 def serve_attachment(request, pk):
-    note = get_object_or_404(Note, pk=pk, user=request.user)
-    
-    decrypted_bytes, file_name = note.get_attachment()
-    
-    if decrypted_bytes is None:
+    attachment = get_object_or_404(Attachment.objects.select_related('blob'), note__pk=pk, note__user=request.user)
+    # The blob digest identifies the bytes; name and type are sent as headers.
+    etag = _etag(attachment.digest, attachment.content_type, attachment.name)
+    response = _conditional_response(request, etag, attachment.created_at)
+    if response is not None:
+        return response
+
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range not in (etag, http_date(attachment.created_at.timestamp())):
+        # The client's partial copy is of an older file: send all of this one.
+        range_header = None
+    try:
+        byte_range = _parse_byte_range(range_header, attachment.size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{attachment.size}'
+        return response
+    start, end = byte_range or (0, attachment.size - 1)
+
+    # Decrypt the first chunk up front so a broken or missing file is a 404,
+    # not a truncated download; the rest is decrypted as the client reads it.
+    pieces = attachment.iter_bytes(start, end)
+    try:
+        first_piece = next(pieces, b'')
+    except (InvalidToken, BlobNotFound):
         raise Http404("No attachment found or decryption failed.")
 
-    content_type, _ = mimetypes.guess_type(file_name)
-    if content_type is None:
-        content_type = 'application/octet-stream' 
+    def stream():
+        yield first_piece
+        yield from pieces
 
-    response = HttpResponse(decrypted_bytes, content_type=content_type)
-    response['Content-Disposition'] = f'inline; filename="{file_name}"'
-    return response
+    response = StreamingHttpResponse(
+        _streaming_content(request, stream()),
+        status=206 if byte_range else 200,
+        content_type=attachment.content_type
+    )
+    response['Content-Length'] = max(end - start + 1, 0)
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{attachment.size}'
+    response['Content-Disposition'] = f'inline; filename="{attachment.name}"'
+    return _set_validators(response, etag, attachment.created_at)
+
+
+# Passages of the user's notes sent with each chat prompt.
+CHAT_CONTEXT_PASSAGES = 5
+
+
+def _chat_context(user_id, prompt, note_id=None):
+    """
+    Returns the context given to the model with a chat prompt: the selected
+    note, or else the passages of all the user's notes most relevant to the
+    prompt. Either way it is kept inside the token budget (what the prompt
+    leaves of it); a note too long for it is replaced by summaries of its
+    parts (see llm.fit_context).
+    """
+    budget = settings.AI_CONTEXT_BUDGET['context_tokens']
+    max_tokens = max(budget - llm.count_tokens(prompt), budget // 4)
+    if note_id:
+        note = Note.objects.filter(pk=note_id, user_id=user_id).first()
+        if note is None:
+            return ''
+        return llm.fit_context(f"Title: {note.title}\n{note.content}", max_tokens)
+
+    passages = NoteEmbedding.search(user_id, prompt, CHAT_CONTEXT_PASSAGES)
+    context = "\n\n".join(f"From the note \"{title}\":\n{text}" for title, text, _ in passages)
+    return llm.fit_context(context, max_tokens)
+
+
+def _chat_history(conversation):
+    """
+    Returns the conversation so far as it is sent with the next prompt: the
+    rolling summary and the turns after it. When those outgrow the history
+    budget, the oldest turns are folded into the summary first.
+    """
+    if conversation.pk is None:
+        return ''
+    turns = conversation.recent_turns()
+    summary, folded = llm.compact_history(
+        conversation.summary,
+        [(turn.role, turn.text, turn.tokens) for turn in turns],
+        settings.AI_CONTEXT_BUDGET['history_tokens'],
+    )
+    if folded:
+        # If another request folded turns meanwhile, its summary is kept;
+        # this prompt still uses the one just made.
+        conversation.fold(summary, turns[folded - 1].index + 1)
+    return llm.format_history(summary, [(turn.role, turn.text) for turn in turns[folded:]])
+
+
+def _get_conversation(user, conversation_id):
+    """
+    Returns the user's conversation with 'conversation_id', or a new unsaved
+    one (saved with its first turns).
+    """
+    conversation = None
+    if str(conversation_id or '').isdigit():
+        conversation = Conversation.objects.filter(pk=conversation_id, user=user).first()
+    return conversation or Conversation(user=user)
+
+
+def _start_chat_turn(user, conversation_id, prompt, note_id=None):
+    """
+    Returns (conversation, note context, history) for a new chat prompt.
+    """
+    conversation = _get_conversation(user, conversation_id)
+    return conversation, _chat_context(user.pk, prompt, note_id), _chat_history(conversation)
+
+
+def chat_job(job):
+    """
+    Handler of 'chat' jobs (see notes/jobs.py): answers a prompt queued by
+    chat_view and adds both to the conversation.
+    """
+    payload = job.payload
+    prompt = payload['prompt']
+    conversation, context, history = _start_chat_turn(
+        job.user, payload['conversation_id'], prompt, payload.get('note_id')
+    )
+    ai_response_raw = llm.generate(prompt, context, history)
+    conversation.add_turns(('user', prompt), ('assistant', ai_response_raw))
+    return {
+        'response': render_markdown(ai_response_raw),
+        'raw_response': ai_response_raw,
+        'conversation_id': conversation.pk,
+    }
 
 
 @login_required
@@ -176,45 +514,128 @@ def chat_view(request):
             if not prompt:
                 return JsonResponse({'error': 'No prompt provided.'}, status=400)
             
-            final_prompt = prompt
-            
-            if note_id:
-                try:
-                    note = Note.objects.get(pk=note_id, user=request.user)
-                    final_prompt = (
-                        f"Please use the following note as context:\n"
-                        f"--- NOTE START ---\n"
-                        f"Title: {note.title}\n"
-                        f"Content: {note.content}\n" 
-                        f"--- NOTE END ---\n\n"
-                        f"Now, please respond to this prompt: {prompt}"
-                    )
-                except Note.DoesNotExist:
-                    pass 
-
-            genai.configure(api_key=settings.GOOGLE_API_KEY)
-            model = genai.GenerativeModel('gemini-2.5-pro') 
-            response = model.generate_content(final_prompt) 
-            
-            # --- MODIFICATIONS HERE ---
-            ai_response_raw = response.text
-            # Use the 'fenced_code' extension
-            ai_response_html = markdown.markdown(ai_response_raw, extensions=['fenced_code'])
-
-            return JsonResponse({'response': ai_response_html, 'raw_response': ai_response_raw})
-            # --- END MODIFICATIONS ---
+            # The reply is made by a background worker (chat_job); the
+            # browser polls job_status for it, or uses chat_stream instead.
+            conversation = _get_conversation(request.user, data.get('conversation_id'))
+            if conversation.pk is None:
+                conversation.save()
+            job = jobs.enqueue('chat', {
+                'prompt': prompt,
+                'note_id': note_id,
+                'conversation_id': conversation.pk,
+            }, user=request.user)
+
+            # Run inline (no worker, see JOB_QUEUE['eager']): answer at once.
+            if job.status == Job.DONE:
+                return JsonResponse(job.result)
+            if job.status == Job.FAILED:
+                return JsonResponse({'error': job.error}, status=500)
+            return JsonResponse({
+                'job_id': job.pk,
+                'status_url': reverse('notes:job_status', args=[job.pk]),
+                'conversation_id': conversation.pk,
+            }, status=202)
 
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
     else:
-        user_notes = Note.objects.filter(user=request.user).order_by('-created_at')
+        user_notes = Note.objects.filter(user=request.user).only('id', 'title').order_by('-created_at')
+        turns = Conversation.latest_turns(request.user)
         context = {
-            'all_notes': user_notes
+            'all_notes': user_notes,
+            'conversation_id': turns[0].conversation_id if turns else '',
+            'turns': [
+                {'role': turn.role, 'text': turn.text,
+                 'html': render_markdown(turn.text) if turn.role == 'assistant' else ''}
+                for turn in turns
+            ],
         }
         return render(request, 'AI/chat.html', context)
 
 
+def _sse_event(event, data):
+    """
+    Formats one Server-Sent Events message with a JSON payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@login_required
+async def chat_stream(request):
+    """
+    Async version of the chat POST that streams the reply as Server-Sent
+    Events ('token' events, then one 'done' or 'error' event). While the
+    model is generating, no worker thread is held.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method.'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON.'}, status=400)
+    prompt = data.get('prompt')
+    note_id = data.get('note_id')
+
+    if not prompt:
+        return JsonResponse({'error': 'No prompt provided.'}, status=400)
+
+    user = await request.auser()
+    conversation_id = data.get('conversation_id')
+
+    async def events():
+        pieces = []
+        try:
+            # Inside the stream: summarizing a long note or history may take a while.
+            conversation, context, history = await sync_to_async(_start_chat_turn)(
+                user, conversation_id, prompt, note_id
+            )
+            async for text in llm.stream(prompt, context, history):
+                pieces.append(text)
+                yield _sse_event('token', {'text': text})
+            ai_response_raw = ''.join(pieces)
+            await sync_to_async(conversation.add_turns)(('user', prompt), ('assistant', ai_response_raw))
+        except Exception as e:
+            yield _sse_event('error', {'error': str(e)})
+            return
+        yield _sse_event('done', {
+            'response': render_markdown(ai_response_raw),
+            'raw_response': ai_response_raw,
+            'conversation_id': conversation.pk,
+        })
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies (nginx) from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# --- Background jobs ---
+
+@login_required
+def job_status(request, pk):
+    """
+    Reports a background job of the user as JSON, with its result once it
+    is done. Meant to be polled until 'status' is 'done' or 'failed'.
+    """
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    data = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+    }
+    if job.status == Job.DONE:
+        data['result'] = job.result
+    elif job.error:
+        data['error'] = job.error
+    response = JsonResponse(data)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
 @login_required
 def save_chat_note(request):
     if request.method == 'POST':
@@ -246,6 +667,52 @@ def save_chat_note(request):
 def about(request):
     return render(request, 'notes/about.html', {'year': datetime.now().year}) 
     
+# Task titles shown per day in the calendar grid; the rest are counted.
+CALENDAR_TITLES_PER_DAY = 3
+
+def _month_task_summary(user, year, month):
+    """
+    Returns {day: {'count': n, 'more': n - shown, 'tasks': [...]}} for the
+    days of a month that have tasks, with at most CALENDAR_TITLES_PER_DAY
+    tasks (dicts with id, title and due_date) per day.
+    """
+    days = {}
+    rows = Task.month_summary(user, year, month, timezone.get_current_timezone(), CALENDAR_TITLES_PER_DAY)
+    for row in rows:
+        summary = days.setdefault(row['day'], {'count': row['day_count'], 'tasks': []})
+        summary['tasks'].append({'id': row['id'], 'title': row['title'], 'due_date': row['due_date']})
+    for summary in days.values():
+        summary['more'] = summary['count'] - len(summary['tasks'])
+    return days
+
+@login_required
+def calendar_summary(request, year, month):
+    """
+    JSON version of the calendar data: per-day task counts and first titles.
+    """
+    if not 1 <= month <= 12:
+        raise Http404("Invalid month.")
+    local_tz = timezone.get_current_timezone()
+    days = _month_task_summary(request.user, year, month)
+    return JsonResponse({
+        'year': year,
+        'month': month,
+        'days': {
+            day: {
+                'count': summary['count'],
+                'tasks': [
+                    {
+                        'id': task['id'],
+                        'title': task['title'],
+                        'due_date': task['due_date'].astimezone(local_tz).isoformat(),
+                    }
+                    for task in summary['tasks']
+                ],
+            }
+            for day, summary in days.items()
+        },
+    })
+
 @login_required
 def calendar_view(request, year=None, month=None):
     today = date.today()
@@ -254,26 +721,18 @@ def calendar_view(request, year=None, month=None):
     year = int(year) if year else today.year
     month = int(month) if month else today.month
 
-    # --- Get tasks for the *entire month* ---
-    tasks = Task.objects.filter(
-        user=request.user, 
-        due_date__year=year, 
-        due_date__month=month
-    ).order_by('due_date') 
-
-    # --- Group tasks by day for easy lookup in the template ---
-    calendar_tasks = {}
-    for task in tasks:
-        day = task.due_date.day
-        if day not in calendar_tasks:
-            calendar_tasks[day] = []
-        calendar_tasks[day].append(task) 
-
-    # --- NEW: Generate the calendar grid (list of weeks) ---
-    # This creates a list of lists, e.g., [[0, 0, 1, 2, 3, 4, 5], [6, ...]]
-    # It respects the correct start day of the week.
-    cal = calendar.Calendar(firstweekday=calendar.SUNDAY) # Start week on Sunday
-    weeks = cal.monthdayscalendar(year, month)
+    # --- Generate the calendar grid (list of weeks) ---
+    # This creates a list of lists of days (0 for padding days), each paired
+    # with that day's summary (per-day task counts and the first few titles,
+    # in one query). It respects the correct start day of the week. Only
+    # built when the cached grid is out of date.
+    def month_weeks():
+        days = _month_task_summary(request.user, year, month)
+        cal = calendar.Calendar(firstweekday=calendar.SUNDAY) # Start week on Sunday
+        return [
+            [(day, days.get(day)) for day in week]
+            for week in cal.monthdayscalendar(year, month)
+        ]
     
     # --- NEW: Get day headers (Sun, Mon, Tue...) ---
     day_headers = calendar.day_abbr[calendar.SUNDAY:] + calendar.day_abbr[:calendar.SUNDAY]
@@ -298,9 +757,9 @@ def calendar_view(request, year=None, month=None):
         'month': month,
         'month_name': current_date.strftime('%B'), # e.g., "November"
         
-        'weeks': weeks,                 # The calendar grid
+        'weeks': SimpleLazyObject(month_weeks),  # The calendar grid [[(day, summary), ...], ...]
+        'cache_version': user_cache_version(request.user.pk),
         'day_headers': day_headers,     # [Sun, Mon, Tue...]
-        'calendar_tasks': calendar_tasks, # Tasks grouped by day {1: [task1], 15: [task2]}
         
         # Highlight today
         'today_day': today.day if today.year == year and today.month == month else None,
@@ -316,13 +775,31 @@ def calendar_view(request, year=None, month=None):
 
 @login_required
 def task(request):
-    # --- REVERTED: Fetches all tasks again ---
-    tasks = Task.objects.filter(user=request.user).order_by('due_date')
     context = {
-        'tasks': tasks,
+        'page_obj': _task_page(request),
     }
     return render(request, 'task/task.html', context)
 
+
+@login_required
+def task_feed(request):
+    """
+    JSON pages of the task list, loaded as the user scrolls.
+    """
+    page = _task_page(request)
+    current_tz = timezone.get_current_timezone()
+    return _feed_response(page, [
+        {
+            'id': t.pk,
+            'title': t.title,
+            'due_date': t.due_date.isoformat(),
+            'due_date_str': t.due_date.astimezone(current_tz).strftime("%b %d, %Y %H:%M"),
+            'edit_url': reverse('notes:task_edit', args=[t.pk]),
+            'delete_url': reverse('notes:task_delete', args=[t.pk]),
+        }
+        for t in page
+    ])
+
 @login_required
 def task_create(request):
     # --- REVERTED: Removed parent_pk ---
@@ -350,6 +827,9 @@ def task_update(request, pk):
         form = TimeScheduleForm(request.POST, instance=task)
         if form.is_valid():
             form.save()
+            if 'due_date' in form.changed_data:
+                # Rescheduled: the task gets a fresh reminder
+                TaskReminder.objects.filter(task=task).delete()
             messages.success(request, f"Task '{task.title}' updated successfully!")
             return redirect('notes:task') 
         else:
@@ -370,29 +850,53 @@ def task_delete(request, pk):
 
 @login_required
 def check_task_notifications(request):
+    # Polling fallback for browsers (or servers) without the push stream below.
+    # One anti-join query finds the undelivered reminders; nothing is kept in
+    # the session.
     now = timezone.now()
-    upcoming_tasks = Task.objects.filter(
-        user=request.user,
-        due_date__lte=now + timedelta(minutes=30), 
-        due_date__gt=now                          
-    )
+    tasks = list(pending_reminders(now, user=request.user)[:MAX_REMINDERS_PER_POLL])
 
-    notified_tasks = request.session.get('notified_tasks', [])
-    tasks_to_notify = []
-    local_tz = timezone.get_current_timezone()
+    if tasks:
+        TaskReminder.record(tasks)
+        TaskReminder.prune(now, user=request.user)
+    return JsonResponse({'tasks': [reminder_payload(task) for task in tasks]})
 
-    for task in upcoming_tasks:
-        if task.pk not in notified_tasks:
-            local_due_date = task.due_date.astimezone(local_tz)
-            tasks_to_notify.append({
-                'id': task.pk,
-                'title': task.title,
-                'due_date_str': local_due_date.strftime("%#I:%M %p") 
-            })
-            notified_tasks.append(task.pk)
+# Seconds between keep-alive comments on an idle reminder stream.
+REMINDER_STREAM_HEARTBEAT = 25
 
-    request.session['notified_tasks'] = notified_tasks
-    return JsonResponse({'tasks': tasks_to_notify})
+@login_required
+async def task_notification_stream(request):
+    """
+    Pushes task reminders to the browser as Server-Sent Events ('reminder'
+    events). All open tabs share one scheduler per process (notes.reminders),
+    so an idle tab costs no database queries.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Long-lived streams need the ASGI server. 204 tells EventSource not
+        # to reconnect, and the page falls back to polling.
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+
+    async def events():
+        hub = get_hub()
+        queue = hub.subscribe(user.pk)
+        try:
+            yield 'retry: 10000\n\n'
+            while True:
+                try:
+                    tasks = await asyncio.wait_for(queue.get(), REMINDER_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield _sse_event('reminder', {'tasks': tasks})
+        finally:
+            hub.unsubscribe(user.pk, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @login_required
 def calendar_day_view(request, year, month, day):